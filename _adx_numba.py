@@ -0,0 +1,173 @@
+"""
+_adx_numba.py - ADX Wilder递推的Numba JIT内核
+一次循环同时算出 TR、±DM、Wilder平滑、±DI、DX 和 ADX，
+取代原来4次 pandas ewm().mean() + 多个中间Series
+
+ADX种子与TA-Lib/MT5一致：第 2*period-1 根K线处取前period个DX的简单均值，
+之后才进入Wilder递推，之前的ADX记0
+
+递推状态 state（长度9的float64数组）:
+    [ATR, +DM平滑, -DM平滑, ADX, 前一根high, 前一根low, 前一根close,
+     该K线下标, 种子期DX累加和]
+
+所有内核都带显式签名：导入时即编译（cache=True 时直接读磁盘缓存），
+实盘第一根K线不再承担类型推断+JIT延迟；启动时可再调用 prewarm() 预热
+"""
+
+import numpy as np
+from _njit import njit
+
+STATE_SIZE = 9
+
+# 显式签名（输入必须是C连续的float64数组，calculate_adx 已保证）
+# 输入声明为只读：pandas写时复制模式下 .values 返回只读数组，可写数组也能传入
+_IN = "Array(float64, 1, 'C', readonly=True)"
+_ADVANCE_SIG = 'UniTuple(float64, 6)(' + ', '.join(['float64'] * 10) + ')'
+_SEED_SIG = 'UniTuple(float64, 2)(float64, float64, float64, int64, int64)'
+_ADX_SIG = 'UniTuple(float64[::1], 4)({0}, {0}, {0}, int64)'.format(_IN)
+_STEP_SIG = ('Tuple((float64[::1], float64, float64, float64))'
+             '({0}, float64, float64, float64, int64)'.format(_IN))
+
+
+@njit(_ADVANCE_SIG, cache=True, fastmath=True, boundscheck=False)
+def _adx_advance(atr, pdm_sm, mdm_sm, ph, pl, pc, h, l, c, alpha):
+    """推进一根K线的TR/±DM Wilder平滑，返回 (atr, +DM平滑, -DM平滑, +DI, -DI, DX)"""
+    # 1. 真实波幅 TR
+    tr = h - l
+    if abs(h - pc) > tr:
+        tr = abs(h - pc)
+    if abs(l - pc) > tr:
+        tr = abs(l - pc)
+
+    # 2. +DM 和 -DM
+    up = h - ph
+    dn = pl - l
+    pdm = up if (up > dn and up > 0.0) else 0.0
+    mdm = dn if (dn > up and dn > 0.0) else 0.0
+
+    # 3. Wilder平滑
+    atr += alpha * (tr - atr)
+    pdm_sm += alpha * (pdm - pdm_sm)
+    mdm_sm += alpha * (mdm - mdm_sm)
+
+    # 4. +DI 和 -DI（ATR为0时记0）
+    if atr > 0.0:
+        p = 100.0 * pdm_sm / atr
+        m = 100.0 * mdm_sm / atr
+    else:
+        p = 0.0
+        m = 0.0
+
+    # 5. DX（分母为0时记0）
+    di_sum = p + m
+    dx = 100.0 * abs(p - m) / di_sum if di_sum != 0.0 else 0.0
+
+    return atr, pdm_sm, mdm_sm, p, m, dx
+
+
+@njit(_SEED_SIG, cache=True, fastmath=True, boundscheck=False)
+def _adx_seed_step(adx_val, dx_sum, dx, i, period):
+    """
+    第i根K线的ADX（DX的Wilder平滑，TA-Lib式种子），返回 (adx, 种子期DX累加和)
+    i < period:            DX尚未稳定，不计入种子，ADX=0
+    period <= i < 2p-1:    累加DX，ADX=0
+    i == 2p-1:             ADX = 前period个DX的均值
+    i > 2p-1:              adx = (adx*(period-1) + dx) / period
+    """
+    seed_at = 2 * period - 1
+    if i < seed_at:
+        if i >= period:
+            dx_sum += dx
+        return 0.0, dx_sum
+    if i == seed_at:
+        return (dx_sum + dx) / period, dx_sum
+    return adx_val + (dx - adx_val) / period, dx_sum
+
+
+@njit(_ADX_SIG, cache=True, fastmath=True, boundscheck=False)
+def _wilder_adx(high, low, close, period):
+    """
+    Wilder平滑ADX（TR/±DM与 ewm(alpha=1/period, adjust=False) 完全等价，
+    ADX按TA-Lib方式以DX均值作种子）
+    输入: float64 一维数组 high/low/close
+    返回: (adx, +DI, -DI, state) —— 前三个为 float64 数组，无NaN；
+          state 为处理完倒数第二根K线后的递推状态（最后一根可能尚未收盘），
+          数据不足2根时全为NaN
+    """
+    n = high.shape[0]
+    adx = np.empty(n)
+    pdi = np.empty(n)
+    mdi = np.empty(n)
+    state = np.full(STATE_SIZE, np.nan)
+    if n == 0:
+        return adx, pdi, mdi, state
+    adx[0] = 0.0
+    pdi[0] = 0.0
+    mdi[0] = 0.0
+
+    alpha = 1.0 / period
+
+    # 第一根K线：TR = high - low，±DM = 0（与pandas ewm的种子一致）
+    atr = high[0] - low[0]
+    pdm_sm = 0.0
+    mdm_sm = 0.0
+    adx_val = 0.0
+    dx_sum = 0.0
+
+    for i in range(n):
+        if i > 0:
+            atr, pdm_sm, mdm_sm, p, m, dx = _adx_advance(
+                atr, pdm_sm, mdm_sm,
+                high[i - 1], low[i - 1], close[i - 1],
+                high[i], low[i], close[i], alpha
+            )
+            adx_val, dx_sum = _adx_seed_step(adx_val, dx_sum, dx, i, period)
+            adx[i] = adx_val
+            pdi[i] = p
+            mdi[i] = m
+
+        if i == n - 2:
+            state[0] = atr
+            state[1] = pdm_sm
+            state[2] = mdm_sm
+            state[3] = adx_val
+            state[4] = high[i]
+            state[5] = low[i]
+            state[6] = close[i]
+            state[7] = i
+            state[8] = dx_sum
+
+    return adx, pdi, mdi, state
+
+
+@njit(_STEP_SIG, cache=True, fastmath=True, boundscheck=False)
+def _wilder_adx_step(state, h, l, c, period):
+    """
+    在 state 之后推进一根K线（O(1)，供实盘/回测逐根更新）
+    返回: (新state, adx, +DI, -DI)，不修改传入的 state
+    """
+    atr, pdm_sm, mdm_sm, p, m, dx = _adx_advance(
+        state[0], state[1], state[2],
+        state[4], state[5], state[6],
+        h, l, c, 1.0 / period
+    )
+    i = int(state[7]) + 1
+    adx_val, dx_sum = _adx_seed_step(state[3], state[8], dx, i, period)
+    new_state = np.empty(STATE_SIZE)
+    new_state[0] = atr
+    new_state[1] = pdm_sm
+    new_state[2] = mdm_sm
+    new_state[3] = adx_val
+    new_state[4] = h
+    new_state[5] = l
+    new_state[6] = c
+    new_state[7] = i
+    new_state[8] = dx_sum
+    return new_state, adx_val, p, m
+
+
+def prewarm():
+    """用64根假K线跑一遍内核，确保编译结果/磁盘缓存在第一个交易周期前就绪"""
+    x = np.linspace(1.0, 2.0, 64)
+    _, _, _, state = _wilder_adx(x + 0.5, x, x + 0.25, 14)
+    _wilder_adx_step(state, 2.5, 2.0, 2.25, 14)
@@ -0,0 +1,242 @@
+"""
+_bt_kernel.py - 回测逐K线持仓管理的Numba JIT内核
+一次调用处理当前K线上的全部持仓：保本 → 移动止损 → 止盈/止损检查，
+取代 _backtest_logic 里逐个持仓dict的Python分支
+
+持仓按结构数组（SoA）存放，前 n 个槽位有效：
+    direction     int8     1=多, -1=空
+    entry/sl/tp   float64  开仓价 / 当前止损 / 止盈
+    be_triggered  int8     是否已触发保本
+    extreme       float64  多单的最高价 / 空单的最低价（移动止损用）
+    last_adj      int8     最近一次止损调整的类型（ADJ_*）
+
+已安装numba时 run_bar 为JIT编译的掩码版本；未安装numba（或运行在PyPy上）时改用逐槽位的标量循环版本：
+持仓只有几个槽位，纯Python下标量循环比一串numpy调用开销小，也便于PyPy的JIT追踪，两者结果相同
+"""
+
+import numpy as np
+from _njit import njit, NUMBA_AVAILABLE
+
+# 止损调整类型（last_adj / adj_flags 的位）
+ADJ_NONE = 0
+ADJ_BE = 1      # 保本
+ADJ_TRAIL = 2   # 移动止损
+
+# 平仓原因编码（止损类 = CLOSE_SL + 最近一次调整类型 last_adj）
+CLOSE_NONE = 0
+CLOSE_TP = 1          # 止盈
+CLOSE_SL = 2          # 止损
+CLOSE_BE_SL = 3       # 保本止损
+CLOSE_TRAIL_SL = 4    # 移动止损
+CLOSE_REASONS = ('', '止盈', '止损', '保本止损', '移动止损')  # 编码 -> 文本
+
+_F8 = "Array(float64, 1, 'C')"
+_I1 = "Array(int8, 1, 'C')"
+_RUN_BAR_SIG = (
+    'UniTuple(int64, 2)(float64, float64, int64, '
+    '{i1}, {f8}, {f8}, {f8}, {i1}, {f8}, {i1}, '
+    'float64, boolean, float64, float64, {i1}, {i1}, {f8})'
+).format(i1=_I1, f8=_F8)
+
+
+@njit(_RUN_BAR_SIG, cache=True, boundscheck=False)
+def _run_bar_masked(price, atr, n,
+            direction, entry, sl, tp, be_triggered, extreme, last_adj,
+            be_trigger, trailing_on, min_profit_mult, trail_mult,
+            adj_flags, close_code, exit_px):
+    """
+    用当前K线收盘价 price 和 ATR 更新前 n 个持仓（原地修改 sl/be_triggered/extreme/last_adj）
+    adj_flags[k]:  本根K线发生的止损调整（ADJ_BE | ADJ_TRAIL 位或）
+    close_code[k]: 平仓原因（CLOSE_*，0表示继续持有）；exit_px[k] 为平仓价（止盈价或止损价）
+    返回: (平仓数, 发生调整的持仓数)
+    """
+    # 全部用掩码在前 n 个槽位上整体计算，没有逐持仓分支
+    d = direction[:n].astype(np.float64)
+    e = entry[:n]
+    s = sl[:n]
+    be = be_triggered[:n]
+    ext = extreme[:n]
+    last = last_adj[:n]
+
+    # 1. 保本：盈利达到 be_trigger×ATR 时止损移到开仓价（只触发一次）
+    profit = (price - e) * d
+    be_mask = (be == 0) & (profit >= be_trigger * atr)
+    s[:] = np.where(be_mask, e, s)
+    be[:] = np.where(be_mask, 1, be)
+    last[:] = np.where(be_mask, ADJ_BE, last)
+    adj = np.where(be_mask, ADJ_BE, ADJ_NONE)
+
+    # 2. 移动止损：盈利超过 min_profit_mult×ATR 后跟随最高/最低价，止损只朝有利方向移动
+    if trailing_on:
+        min_profit = min_profit_mult * atr
+        move = profit > min_profit
+        ext[:] = np.where(move, np.where(d > 0, np.maximum(ext, price), np.minimum(ext, price)), ext)
+        new_sl = ext - d * (trail_mult * atr)
+        trail_mask = move & ((ext - e) * d > min_profit) & ((new_sl - s) * d > 0.0)
+        s[:] = np.where(trail_mask, new_sl, s)
+        last[:] = np.where(trail_mask, ADJ_TRAIL, last)
+        adj = adj | np.where(trail_mask, ADJ_TRAIL, ADJ_NONE)
+
+    adj_flags[:n] = adj
+
+    # 3. 止盈 / 止损（exit_px 只对平仓的槽位有意义）
+    #    止损原因直接由 last_adj 得出：未调整→止损，保本后未再移动→保本止损，移动过→移动止损
+    tp_hit = (price - tp[:n]) * d >= 0.0
+    sl_hit = (price - s) * d <= 0.0
+    code = np.where(tp_hit, CLOSE_TP, np.where(sl_hit, CLOSE_SL + last, CLOSE_NONE))
+    close_code[:n] = code
+    exit_px[:n] = np.where(tp_hit, tp[:n], s)
+
+    n_closed = np.count_nonzero(code)
+    n_adjusted = np.count_nonzero(adj)
+    return n_closed, n_adjusted
+
+
+def _run_bar_loop(price, atr, n,
+                  direction, entry, sl, tp, be_triggered, extreme, last_adj,
+                  be_trigger, trailing_on, min_profit_mult, trail_mult,
+                  adj_flags, close_code, exit_px):
+    """run_bar 的纯Python版本：逐个槽位的标量运算，参数和结果同 _run_bar_masked"""
+    be_dist = be_trigger * atr
+    min_profit = min_profit_mult * atr
+    trail_dist = trail_mult * atr
+    n_closed = 0
+    n_adjusted = 0
+    for k in range(n):
+        d = int(direction[k])
+        e = float(entry[k])
+        s = float(sl[k])
+        last = int(last_adj[k])
+        adj = ADJ_NONE
+
+        # 1. 保本
+        profit = (price - e) * d
+        if be_triggered[k] == 0 and profit >= be_dist:
+            s = e
+            be_triggered[k] = 1
+            last = ADJ_BE
+            adj = ADJ_BE
+
+        # 2. 移动止损（止损只朝有利方向移动）
+        if trailing_on and profit > min_profit:
+            ext = float(extreme[k])
+            if d > 0:
+                if price > ext:
+                    ext = price
+            elif price < ext:
+                ext = price
+            extreme[k] = ext
+            new_sl = ext - d * trail_dist
+            if (ext - e) * d > min_profit and (new_sl - s) * d > 0.0:
+                s = new_sl
+                last = ADJ_TRAIL
+                adj |= ADJ_TRAIL
+
+        sl[k] = s
+        last_adj[k] = last
+        adj_flags[k] = adj
+        if adj != ADJ_NONE:
+            n_adjusted += 1
+
+        # 3. 止盈 / 止损（止损原因 = CLOSE_SL + last_adj）
+        t = float(tp[k])
+        if (price - t) * d >= 0.0:
+            close_code[k] = CLOSE_TP
+            exit_px[k] = t
+            n_closed += 1
+        elif (price - s) * d <= 0.0:
+            close_code[k] = CLOSE_SL + last
+            exit_px[k] = s
+            n_closed += 1
+        else:
+            close_code[k] = CLOSE_NONE
+
+    return n_closed, n_adjusted
+
+
+run_bar = _run_bar_masked if NUMBA_AVAILABLE else _run_bar_loop
+
+
+@njit('float64(int64, float64, float64, float64, float64)', cache=True)
+def trade_pnl(direction, entry, exit_price, lot, spread):
+    """
+    扣除点差后的单笔盈亏（美元，1手=100盎司）
+    开仓、平仓各付半个点差，合计正好一个点差：((平仓价 - 开仓价)×方向 - 点差) × 手数 × 100
+    """
+    return ((exit_price - entry) * direction - spread) * lot * 100.0
+
+
+class BacktestPositions:
+    """
+    回测持仓的结构数组（SoA）容器，容量固定为最大持仓数
+    开仓写入第 n 个槽位；平仓把最后一个槽位换到空位再 n-1（O(1)，无列表删除）
+    槽位顺序因此不等于开仓顺序，seq 记录开仓序号，同一根K线的多笔平仓按 seq 处理
+    entry_ns 为开仓时间（int64纳秒），格式化成字符串留到回测结束后整列一次完成
+    meta 为与槽位对应的Python对象（市场类型、调整记录等只在开平仓时用到的字段）
+    """
+
+    __slots__ = ('direction', 'entry', 'sl', 'tp', 'be_triggered', 'extreme', 'last_adj',
+                 'lot', 'initial_sl', 'entry_atr', 'entry_ns', 'seq', 'meta', 'n', '_next_seq',
+                 '_arrays')
+
+    def __init__(self, capacity):
+        self.direction = np.zeros(capacity, dtype=np.int8)
+        self.entry = np.zeros(capacity)
+        self.sl = np.zeros(capacity)
+        self.tp = np.zeros(capacity)
+        self.be_triggered = np.zeros(capacity, dtype=np.int8)
+        self.extreme = np.zeros(capacity)
+        self.last_adj = np.zeros(capacity, dtype=np.int8)
+        self.lot = np.zeros(capacity)
+        self.initial_sl = np.zeros(capacity)
+        self.entry_atr = np.zeros(capacity)
+        self.entry_ns = np.zeros(capacity, dtype=np.int64)
+        self.seq = np.zeros(capacity, dtype=np.int64)
+        self.meta = [None] * capacity
+        self.n = 0
+        self._next_seq = 0
+        self._arrays = (self.direction, self.entry, self.sl, self.tp, self.be_triggered,
+                        self.extreme, self.last_adj, self.lot, self.initial_sl,
+                        self.entry_atr, self.entry_ns, self.seq)
+
+    def __len__(self):
+        return self.n
+
+    def open(self, direction, entry, sl, tp, lot, entry_atr, entry_ns, meta):
+        """开仓写入第 n 个槽位（调用方保证未满）"""
+        k = self.n
+        self.direction[k] = direction
+        self.entry[k] = entry
+        self.sl[k] = sl
+        self.initial_sl[k] = sl
+        self.tp[k] = tp
+        self.be_triggered[k] = 0
+        self.extreme[k] = entry  # 多单记最高价、空单记最低价
+        self.last_adj[k] = ADJ_NONE
+        self.lot[k] = lot
+        self.entry_atr[k] = entry_atr
+        self.entry_ns[k] = entry_ns
+        self.seq[k] = self._next_seq
+        self.meta[k] = meta
+        self._next_seq += 1
+        self.n = k + 1
+
+    def remove(self, k):
+        """删除槽位 k：最后一个槽位换过来，n-1"""
+        last = self.n - 1
+        if k != last:
+            for arr in self._arrays:
+                arr[k] = arr[last]
+            self.meta[k] = self.meta[last]
+        self.meta[last] = None
+        self.n = last
+
+    def closed_slots(self, close_code):
+        """run_bar 标记平仓的槽位，按开仓顺序排列"""
+        slots = np.flatnonzero(close_code[:self.n])
+        return slots[np.argsort(self.seq[slots], kind='stable')]
+
+    def remove_slots(self, slots):
+        """批量删除：从大到小逐个换位删除，被换过来的槽位不会是待删槽位"""
+        for k in np.sort(slots)[::-1]:
+            self.remove(k)
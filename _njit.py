@@ -0,0 +1,26 @@
+"""
+_njit.py - Numba 可选依赖封装
+安装了numba时导出真正的 njit / prange；
+未安装时退化为原样返回函数的空装饰器，代码照常运行（只是没有JIT加速）
+在PyPy上不导入numba（numba不支持PyPy），纯Python回退路径由PyPy自带的JIT加速
+"""
+
+import sys
+
+try:
+    if sys.implementation.name == 'pypy':
+        raise ImportError('numba不支持PyPy')
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:  # numba未安装或运行在PyPy上：回退为纯Python
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """空装饰器：兼容 @njit 和 @njit(...) 两种写法"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+
+        def decorator(func):
+            return func
+        return decorator
@@ -8,6 +8,9 @@ adx_analyzer.py - ADX计算和市场类型判断（修复优化版）
 5. 优化identify_market_type的方向判断（容差3点，避免弱方向误判）
 6. 打印报告更醒目，第一行直接显示当前推荐策略（网格还是趋势）
 7. 小幅优化性能和数值稳定性
+8. ADX核心递推改为Numba JIT单次循环（未安装numba时自动回退pandas向量化实现）
+9. 新增identify_market_type_vec，numpy掩码批量给历史K线打整数标签（查找表解码）
+10. ADX种子改为TA-Lib/MT5口径（第2p-1根取DX均值再Wilder递推），不再从0开始ewm
 专为XAUUSD黄金交易优化，整合到自适应策略系统中
 """
 
@@ -15,6 +18,19 @@ import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 
+from _njit import NUMBA_AVAILABLE
+from _adx_numba import _wilder_adx, _wilder_adx_step, prewarm
+
+# 整数编码 -> 文本的查找表（向量化打标签后只对当前K线解码）
+# 市场类型: 0=盘整, 1=趋势开始, 2=强单边
+MARKET_TYPES = ('RANGING', 'TRENDING', 'TRENDING')
+MARKET_DESCS = ('盘整/双边市', '趋势开始', '强单边市')
+MARKET_STRENGTHS = ('弱', '中', '强')
+# 方向: -1=看跌, 0=中性, 1=看涨（下标用 code + 1）
+DIRECTIONS = ('看跌', '中性', '看涨')
+DIRECTION_CODES = ('BEARISH', 'NEUTRAL', 'BULLISH')
+
+
 class ADXAnalyzer:
     """ADX计算和行情类型判断（标准Wilder平滑版）"""
     
@@ -22,55 +38,106 @@ class ADXAnalyzer:
         self.period = period
         self.adx_threshold = adx_threshold
         self.alpha = 1.0 / period  # Wilder平滑系数
+        # 增量更新用：最近一根已收盘K线之后的Wilder递推状态（见 _adx_numba.py）
+        self.state = None
         
     def calculate_adx(self, high, low, close):
         """
-        计算ADX指标（标准Wilder平滑实现）
-        返回: (adx, +DI, -DI) 均为Series，已fillna(0)
+        计算ADX指标（标准Wilder平滑实现，ADX种子同TA-Lib/MT5）
+        返回: (adx, +DI, -DI) 均为Series，无NaN；前 2*period-1 根的ADX为0
+        同时把倒数第二根K线处的递推状态存入 self.state（最后一根可能尚未收盘）
         """
-        # 确保是Series
-        high = pd.Series(high) if not isinstance(high, pd.Series) else high
-        low = pd.Series(low) if not isinstance(low, pd.Series) else low
-        close = pd.Series(close) if not isinstance(close, pd.Series) else close
+        # 统一转成连续float64数组，全程在ndarray上计算，只在返回时包装成Series
+        index = high.index if isinstance(high, pd.Series) else pd.RangeIndex(len(high))
+        h = np.ascontiguousarray(high, dtype=np.float64)
+        l = np.ascontiguousarray(low, dtype=np.float64)
+        c = np.ascontiguousarray(close, dtype=np.float64)
         
-        # 1. 真实波幅 TR
-        tr1 = high - low
-        tr2 = abs(high - close.shift(1))
-        tr3 = abs(low - close.shift(1))
-        tr = pd.concat([tr1, tr2, tr3], axis=1).max(axis=1)
+        if NUMBA_AVAILABLE:
+            adx, pos_di, neg_di, state = _wilder_adx(h, l, c, self.period)
+            self.state = None if np.isnan(state[0]) else state
+            return (pd.Series(adx, index=index),
+                    pd.Series(pos_di, index=index),
+                    pd.Series(neg_di, index=index))
         
-        # 2. +DM 和 -DM
-        up_move = high.diff()
-        down_move = -low.diff()
+        # 未安装numba：pandas向量化实现
+        # 前一根收盘价只算一次
+        cp = np.empty_like(c)
+        cp[:1] = c[:1]
+        cp[1:] = c[:-1]
         
-        pos_dm = np.where((up_move > down_move) & (up_move > 0), up_move, 0)
-        neg_dm = np.where((down_move > up_move) & (down_move > 0), down_move, 0)
+        # 1. 真实波幅 TR（三项逐元素取最大，一次reduce）
+        tr = np.maximum.reduce([h - l, np.abs(h - cp), np.abs(l - cp)])
         
-        pos_dm = pd.Series(pos_dm, index=high.index)
-        neg_dm = pd.Series(neg_dm, index=high.index)
+        # 2. +DM 和 -DM（原生np.diff，首根差值为0，即±DM=0）
+        up_move = np.diff(h, prepend=h[:1])
+        down_move = -np.diff(l, prepend=l[:1])
         
-        # 3. Wilder平滑（等价于EMA adjust=False）
-        atr = tr.ewm(alpha=self.alpha, adjust=False).mean()
-        pos_dm_smooth = pos_dm.ewm(alpha=self.alpha, adjust=False).mean()
-        neg_dm_smooth = neg_dm.ewm(alpha=self.alpha, adjust=False).mean()
+        pos_dm = np.where((up_move > down_move) & (up_move > 0), up_move, 0.0)
+        neg_dm = np.where((down_move > up_move) & (down_move > 0), down_move, 0.0)
         
-        # 4. +DI 和 -DI
-        pos_di = 100 * pos_dm_smooth / atr
-        neg_di = 100 * neg_dm_smooth / atr
+        # 3. Wilder平滑（等价于EMA adjust=False）：TR/+DM/-DM拼成三列，一次ewm扫完，之后全程用ndarray
+        smooth = pd.DataFrame(np.column_stack((tr, pos_dm, neg_dm))).ewm(
+            alpha=self.alpha, adjust=False).mean().to_numpy()
+        atr = smooth[:, 0]
+        pos_dm_smooth = smooth[:, 1]
+        neg_dm_smooth = smooth[:, 2]
+        
+        # 4. +DI 和 -DI（ATR为0时记0，同numba内核，不产生NaN）
+        valid = atr > 0
+        pos_di = np.divide(100 * pos_dm_smooth, atr, out=np.zeros_like(atr), where=valid)
+        neg_di = np.divide(100 * neg_dm_smooth, atr, out=np.zeros_like(atr), where=valid)
         
         # 5. DX（处理分母为0）
         di_sum = pos_di + neg_di
-        dx = np.where(di_sum == 0, 0, 100 * abs(pos_di - neg_di) / di_sum)
-        dx = pd.Series(dx, index=high.index)
+        dx = np.divide(100 * np.abs(pos_di - neg_di), di_sum,
+                       out=np.zeros_like(di_sum), where=di_sum != 0)
         
-        # 6. ADX（DX的Wilder平滑）
-        adx = dx.ewm(alpha=self.alpha, adjust=False).mean()
+        # 6. ADX（DX的Wilder平滑，TA-Lib式种子：第2p-1根取前p个DX均值，之前记0）
+        #    把种子放在序列首位再做ewm，即得 adx = (adx*(p-1) + dx) / p 的递推
+        p = self.period
+        seed_at = 2 * p - 1
+        adx = np.zeros(len(dx))
+        if len(dx) > seed_at:
+            tail = dx[seed_at:].copy()
+            tail[0] = dx[p:seed_at + 1].mean()
+            adx[seed_at:] = pd.Series(tail).ewm(alpha=self.alpha, adjust=False).mean().to_numpy()
         
-        # 填充初始NaN为0（确保最新值永远可用）
-        adx = adx.fillna(0)
-        pos_di = pos_di.fillna(0)
-        neg_di = neg_di.fillna(0)
+        # 保存倒数第二根K线处的递推状态
+        n = len(h)
+        if n >= 2:
+            self.state = np.array([
+                atr[-2], pos_dm_smooth[-2], neg_dm_smooth[-2], adx[-2],
+                h[-2], l[-2], c[-2],
+                n - 2, dx[p:min(seed_at, n - 1)].sum()
+            ], dtype=np.float64)
+        else:
+            self.state = None
         
+        # 每一步都已处理好分母为0的情况，输出无NaN，无需再fillna
+        return (pd.Series(adx, index=index),
+                pd.Series(pos_di, index=index),
+                pd.Series(neg_di, index=index))
+    
+    def commit_bar(self, high, low, close):
+        """
+        把一根已收盘K线推进到递推状态（O(1)）
+        返回该K线的 (adx, +DI, -DI)
+        """
+        self.state, adx, pos_di, neg_di = _wilder_adx_step(
+            self.state, float(high), float(low), float(close), self.period
+        )
+        return adx, pos_di, neg_di
+    
+    def update_last_bar(self, new_h, new_l, new_c):
+        """
+        基于已收盘K线的递推状态计算最新一根K线的ADX（O(1)，不改变状态，
+        最新K线未收盘、价格每跳变化时可反复调用）
+        返回: (adx, +DI, -DI)
+        """
+        _, adx, pos_di, neg_di = _wilder_adx_step(
+            self.state, float(new_h), float(new_l), float(new_c), self.period
+        )
         return adx, pos_di, neg_di
     
     def identify_market_type(self, adx_value, pos_di, neg_di):
@@ -82,30 +149,43 @@ class ADXAnalyzer:
         
         # 市场类型
         if adx_value < self.adx_threshold:
-            market_type = 'RANGING'
-            market_desc = '盘整/双边市'
-            strength = '弱'
+            market = 0
+        elif adx_value >= 40:
+            market = 2
         else:
-            market_type = 'TRENDING'
-            if adx_value >= 40:
-                market_desc = '强单边市'
-                strength = '强'
-            else:
-                market_desc = '趋势开始'
-                strength = '中'
+            market = 1
         
         # 方向判断（容差3点，避免小幅震荡误判中性）
         if di_diff > 3:
-            direction = '看涨'
-            direction_code = 'BULLISH'
+            direction = 1
         elif di_diff < -3:
-            direction = '看跌'
-            direction_code = 'BEARISH'
+            direction = -1
         else:
-            direction = '中性'
-            direction_code = 'NEUTRAL'
+            direction = 0
+        
+        return (MARKET_TYPES[market], MARKET_DESCS[market], MARKET_STRENGTHS[market],
+                DIRECTIONS[direction + 1], DIRECTION_CODES[direction + 1], di_diff)
+    
+    def identify_market_type_vec(self, adx, pos_di, neg_di):
+        """
+        identify_market_type 的向量化版本（回测/历史K线批量打标签用）
+        返回: {'market_code': int8数组 0=盘整/1=趋势开始/2=强单边,
+               'direction_code': int8数组 -1=看跌/0=中性/1=看涨,
+               'di_diff': float64数组}
+        用 MARKET_*/DIRECTION* 查找表解码成文本
+        """
+        adx = np.asarray(adx, dtype=np.float64)
+        di_diff = np.asarray(pos_di, dtype=np.float64) - np.asarray(neg_di, dtype=np.float64)
         
-        return market_type, market_desc, strength, direction, direction_code, di_diff
+        trending = adx >= self.adx_threshold
+        market_code = trending.astype(np.int8) + (trending & (adx >= 40)).astype(np.int8)
+        direction_code = (di_diff > 3).astype(np.int8) - (di_diff < -3).astype(np.int8)
+        
+        return {
+            'market_code': market_code,
+            'direction_code': direction_code,
+            'di_diff': di_diff,
+        }
     
     def get_trading_suggestion(self, adx_value, market_desc, direction):
         """交易建议"""
@@ -122,30 +202,92 @@ class MarketAnalysis:
     """市场分析主类（优化版）"""
     
     def __init__(self, df, adx_threshold=20):
-        self.df = df.copy() if df is not None else None
+        # 直接引用调用方的DataFrame（不整表复制），ADX/+DI/-DI列写回该DataFrame
+        self.df = df
         self.analyzer = ADXAnalyzer(period=14, adx_threshold=adx_threshold)
         self.adx_threshold = adx_threshold
+        # 上次分析的K线索引和ADX列（供下一次增量更新）
+        self._last_index = None
+        self._last_cols = None
     
-    def analyze(self):
-        """执行分析并添加指标"""
+    def analyze(self, df=None):
+        """
+        执行分析并添加指标
+        df: 传入最新K线数据；若只是比上次多了一根K线（或最新K线价格变化），
+            复用上次的Wilder递推状态，只增量计算最后1~2根，O(1)
+        注意: 不复制df，ADX/+DI/-DI 三列直接写入传入的DataFrame并返回它本身
+        """
+        if df is not None:
+            self.df = df
+        
         if self.df is None or len(self.df) < 30:  # 至少30根才可靠
+            self._last_index = None
             print(f"⚠️  数据不足（当前{len(self.df) if self.df is not None else 0}根K线），ADX暂不可用，将默认使用RANGING模式")
             if self.df is not None:
-                self.df['ADX'] = 0.0
-                self.df['+DI'] = 0.0
-                self.df['-DI'] = 0.0
+                self.df.loc[:, 'ADX'] = 0.0
+                self.df.loc[:, '+DI'] = 0.0
+                self.df.loc[:, '-DI'] = 0.0
             return self.df
         
-        adx, pos_di, neg_di = self.analyzer.calculate_adx(
-            self.df['high'], self.df['low'], self.df['close']
-        )
+        cols = self._incremental_update()
+        if cols is None:
+            adx, pos_di, neg_di = self.analyzer.calculate_adx(
+                self.df['high'], self.df['low'], self.df['close']
+            )
+            cols = (adx.values, pos_di.values, neg_di.values)
+        
+        self.df.loc[:, 'ADX'] = cols[0]
+        self.df.loc[:, '+DI'] = cols[1]
+        self.df.loc[:, '-DI'] = cols[2]
         
-        self.df['ADX'] = adx
-        self.df['+DI'] = pos_di
-        self.df['-DI'] = neg_di
+        self._last_index = self.df.index
+        self._last_cols = cols
         
         return self.df
     
+    def _incremental_update(self):
+        """
+        增量计算ADX列：新数据相对上次只新增了一根K线，或最后一根K线仍在变化
+        返回 (adx, +DI, -DI) 三个数组；无法增量时返回None（走全量计算）
+        """
+        prev_index = self._last_index
+        if prev_index is None or self.analyzer.state is None:
+            return None
+        
+        index = self.df.index
+        n = len(index)
+        if index[-1] == prev_index[-1]:
+            shift = 0  # 同一根K线（未收盘，价格更新）
+        elif index[-2] == prev_index[-1]:
+            shift = 1  # 新开一根K线，上一根已收盘
+        else:
+            return None
+        
+        # 新数据第j行对应上次结果的第 j+offset 行
+        offset = len(prev_index) - n + shift
+        if offset < 0:
+            return None
+        
+        high = self.df['high'].values
+        low = self.df['low'].values
+        close = self.df['close'].values
+        
+        keep = n - 1 - shift
+        cols = tuple(np.empty(n) for _ in range(3))
+        for col, prev_col in zip(cols, self._last_cols):
+            col[:keep] = prev_col[offset:offset + keep]
+        
+        if shift == 1:
+            closed = self.analyzer.commit_bar(high[-2], low[-2], close[-2])
+            for col, value in zip(cols, closed):
+                col[-2] = value
+        
+        latest = self.analyzer.update_last_bar(high[-1], low[-1], close[-1])
+        for col, value in zip(cols, latest):
+            col[-1] = value
+        
+        return cols
+    
     def get_current_market_info(self):
         """获取当前市场信息（安全取值）"""
         if self.df is None or len(self.df) == 0 or 'ADX' not in self.df.columns:
@@ -165,11 +307,11 @@ class MarketAnalysis:
                 'suggestion': '数据不足，默认使用双边网格策略'
             }
         
-        latest = self.df.iloc[-1]
-        
-        adx_val = float(latest.get('ADX', 0.0))
-        pos_di = float(latest.get('+DI', 0.0))
-        neg_di = float(latest.get('-DI', 0.0))
+        # 直接按列取最后一个标量（.iat），不构造整行Series
+        df = self.df
+        adx_val = float(df['ADX'].iat[-1])
+        pos_di = float(df['+DI'].iat[-1]) if '+DI' in df.columns else 0.0
+        neg_di = float(df['-DI'].iat[-1]) if '-DI' in df.columns else 0.0
         
         market_type, market_desc, strength, direction, direction_code, di_diff = self.analyzer.identify_market_type(
             adx_val, pos_di, neg_di
@@ -189,32 +331,41 @@ class MarketAnalysis:
             'direction_signal': direction_signal,
             'is_ranging': market_type == 'RANGING',
             'is_trending': market_type == 'TRENDING',
-            'price': float(latest['close']) if 'close' in latest else 0.0,
+            'price': float(df['close'].iat[-1]) if 'close' in df.columns else 0.0,
             'suggestion': self.analyzer.get_trading_suggestion(adx_val, market_desc, direction)
         }
     
-    def print_market_report(self):
-        """打印醒目市场报告（第一行直接显示当前策略）"""
-        info = self.get_current_market_info()
-        
-        print("\n" + "="*70)
-        print("🤖 ADX自适应策略 - 当前市场状态")
-        print("="*70)
-        
+    def format_report(self, info):
+        """把 get_current_market_info() 的结果格式化成醒目报告文本（第一行直接显示当前策略）"""
         # 第一行最醒目：当前策略
         if info['is_ranging']:
-            print("🔄 当前推荐策略 → 双边网格策略（震荡市）")
+            strategy_line = "🔄 当前推荐策略 → 双边网格策略（震荡市）"
         else:
-            print("📈📉 当前推荐策略 → 单边趋势策略（趋势市）")
-        
-        print(f"💰 当前价格: ${info['price']:.2f}")
-        print(f"📊 ADX 值: {info['adx']:.2f}  （阈值 {self.adx_threshold}）")
-        print(f"📈 +DI: {info['+DI']:.2f}   📉 -DI: {info['-DI']:.2f}   🔄 DI差: {info['di_diff']:+.2f}")
-        print(f"🏷️  市场状态: {info['market_desc']}（强度：{info['strength']}）")
-        print(f"🧭  方向: {info['direction']}")
-        print(f"💡  交易建议: {info['suggestion']}")
-        print("="*70 + "\n")
+            strategy_line = "📈📉 当前推荐策略 → 单边趋势策略（趋势市）"
         
+        lines = [
+            "\n" + "="*70,
+            "🤖 ADX自适应策略 - 当前市场状态",
+            "="*70,
+            strategy_line,
+            f"💰 当前价格: ${info['price']:.2f}",
+            f"📊 ADX 值: {info['adx']:.2f}  （阈值 {self.adx_threshold}）",
+            f"📈 +DI: {info['+DI']:.2f}   📉 -DI: {info['-DI']:.2f}   🔄 DI差: {info['di_diff']:+.2f}",
+            f"🏷️  市场状态: {info['market_desc']}（强度：{info['strength']}）",
+            f"🧭  方向: {info['direction']}",
+            f"💡  交易建议: {info['suggestion']}",
+            "="*70 + "\n",
+        ]
+        return "\n".join(lines)
+    
+    def print_market_report(self, silent=False):
+        """
+        打印醒目市场报告并返回市场信息dict
+        silent=True: 只返回dict，跳过所有字符串格式化（回测/参数寻优逐根K线调用时用）
+        """
+        info = self.get_current_market_info()
+        if not silent:
+            print(self.format_report(info))
         return info
 
 # ==================== 使用示例（保留原测试代码，便于本地验证） ====================
@@ -240,6 +391,7 @@ def generate_sample_data(periods=100):
 
 if __name__ == "__main__":
     print("🧪 ADX分析器测试...")
+    prewarm()
     
     # 生成示例数据
     df = generate_sample_data(periods=200)
@@ -55,6 +55,7 @@ RISK_CONFIG = {
     # 添加移动止损所需参数
     'min_profit_move_sl': 1.0,    # 触发移动止损的最小利润（ATR倍数）
     'trailing_distance': 1.2,     # 移动止损距离（ATR倍数）
+    'close_on_stop': False,       # 无人值守（非终端启动）时停止机器人是否平掉全部持仓
 }
 
 # ==================== ADX自适应策略配置（新增）====================
@@ -85,4 +86,25 @@ LOG_CONFIG = {
     'level': 'INFO',
     'save_to_file': True,
     'log_file': 'trading_bot.log'
-}
\ No newline at end of file
+}
+# ==================== 启动时显示的配置摘要 ====================
+# 配置在运行期间不变，导入时一次性拼好，show_config 直接打印
+_ADX_THRESHOLD = ADX_CONFIG['adx_threshold']
+CONFIG_BANNER = "\n".join(filter(None, [
+    "\n" + "="*70,
+    "⚙️  系统配置",
+    "="*70,
+    f"交易品种: {TRADING_CONFIG['symbol']}",
+    f"时间周期: {TRADING_CONFIG['timeframe']}分钟",
+    f"每笔风险: {TRADING_CONFIG['risk_per_trade']*100}%",
+    f"最大持仓: {TRADING_CONFIG['max_positions']} 单（网格/趋势均适用）",
+    f"ADX阈值: {_ADX_THRESHOLD}",
+    f"ADX<{_ADX_THRESHOLD}: 双边网格策略（允许多层加仓）",
+    f"ADX≥{_ADX_THRESHOLD}: 单边趋势策略（允许重复开单，最多{TRADING_CONFIG['max_positions']}单）",
+    f"移动止损: {'启用' if RISK_CONFIG['trailing_stop'] else '禁用'}",
+    f"移动止损触发: {RISK_CONFIG['min_profit_move_sl']}×ATR" if RISK_CONFIG['trailing_stop'] else None,
+    f"保本逻辑: 启用 (触发: {RISK_CONFIG['break_even_trigger']}×ATR)",
+    "震荡市休眠: 启用（低波动自动0单）" if STRATEGY_PARAMS.get('enable_vol_filter') else None,
+    "\n⚠️  按 Ctrl+C 停止机器人",
+    "="*70 + "\n",
+]))
@@ -3,16 +3,45 @@
 支持更快EMA + 所有策略所需指标
 """
 
+import hashlib
+from collections import OrderedDict
+
 import pandas as pd
 import numpy as np
+from scipy.signal import lfilter
+
+from _njit import NUMBA_AVAILABLE
+from indicators_numba import (compute_all, compute_all_tail, rsi_wilder,
+                              atr_sma, bollinger_bands, stochastic, REC_SIZE)
+
+# calculate_all_indicators 输出的指标列（顺序与 compute_all 返回值一致）
+INDICATOR_COLUMNS = (
+    'EMA_8', 'EMA_21', 'EMA_100', 'RSI',
+    'MACD', 'MACD_signal', 'MACD_hist',
+    'BB_upper', 'BB_middle', 'BB_lower',
+    'ATR', 'MOM', 'STOCH_K', 'STOCH_D',
+)
+
+# 指标结果缓存：回测/参数寻优反复对同一段K线计算时直接复用（LRU，最多32份）
+_INDICATOR_CACHE = OrderedDict()
+_INDICATOR_CACHE_SIZE = 32
 
 class TechnicalIndicators:
     """技术指标计算类"""
     
     @staticmethod
     def calculate_ema(data, period):
-        """计算指数移动平均线"""
-        return data.ewm(span=period, adjust=False).mean()
+        """
+        计算指数移动平均线（scipy lfilter的C实现IIR，与 ewm(span, adjust=False) 等价）
+        """
+        alpha = 2.0 / (period + 1)
+        arr = np.asarray(data, dtype=np.float64)
+        if arr.size == 0:
+            return pd.Series(arr, index=data.index)
+        # 初始状态取第一个值，使 y[0] = x[0]（与adjust=False的种子一致）
+        zi = [(1.0 - alpha) * arr[0]]
+        y, _ = lfilter([alpha], [1.0, alpha - 1.0], arr, zi=zi)
+        return pd.Series(y, index=data.index)
     
     @staticmethod
     def calculate_sma(data, period):
@@ -21,27 +50,47 @@ class TechnicalIndicators:
     
     @staticmethod
     def calculate_rsi(data, period=14):
-        """计算RSI"""
-        delta = data.diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-        rs = gain / loss
-        rsi = 100 - (100 / (1 + rs))
-        return rsi
+        """
+        计算RSI（Wilder平滑，alpha=1/period，与TA-Lib/MT5口径一致）
+        前 period-1 根保持NaN；跌幅均值为0时做下限截断，避免除零
+        """
+        arr = np.asarray(data, dtype=np.float64)
+        if arr.size == 0:
+            return pd.Series(arr, index=data.index)
+        if NUMBA_AVAILABLE:
+            # Wilder递推单次JIT循环
+            return pd.Series(rsi_wilder(np.ascontiguousarray(arr), int(period)), index=data.index)
+        delta = np.diff(arr, prepend=arr[0])
+        gain = np.where(delta > 0, delta, 0.0)
+        loss = np.where(delta < 0, -delta, 0.0)
+        a = 1.0 / period
+        avg_gain = lfilter([a], [1.0, a - 1.0], gain)
+        avg_loss = lfilter([a], [1.0, a - 1.0], loss)
+        rs = avg_gain / np.maximum(avg_loss, 1e-12)
+        rsi = 100.0 - 100.0 / (1.0 + rs)
+        rsi[:period - 1] = np.nan
+        return pd.Series(rsi, index=data.index)
     
     @staticmethod
     def calculate_macd(data, fast=12, slow=26, signal=9):
         """计算MACD"""
-        exp1 = data.ewm(span=fast, adjust=False).mean()
-        exp2 = data.ewm(span=slow, adjust=False).mean()
+        exp1 = TechnicalIndicators.calculate_ema(data, fast)
+        exp2 = TechnicalIndicators.calculate_ema(data, slow)
         macd = exp1 - exp2
-        macd_signal = macd.ewm(span=signal, adjust=False).mean()
+        macd_signal = TechnicalIndicators.calculate_ema(macd, signal)
         macd_hist = macd - macd_signal
         return macd, macd_signal, macd_hist
     
     @staticmethod
     def calculate_bollinger_bands(data, period=20, std=2):
-        """计算布林带"""
+        """计算布林带（已安装numba时单次遍历同时算均值和标准差）"""
+        if NUMBA_AVAILABLE:
+            arr = np.ascontiguousarray(np.asarray(data, dtype=np.float64))
+            upper, middle, lower = bollinger_bands(arr, int(period), float(std))
+            return (pd.Series(upper, index=data.index),
+                    pd.Series(middle, index=data.index),
+                    pd.Series(lower, index=data.index))
+        
         middle = data.rolling(window=period).mean()
         std_dev = data.rolling(window=period).std()
         upper = middle + (std_dev * std)
@@ -51,6 +100,15 @@ class TechnicalIndicators:
     @staticmethod
     def calculate_atr(high, low, close, period=14):
         """计算ATR"""
+        if NUMBA_AVAILABLE:
+            # TR + 滚动均值单次JIT循环
+            atr = atr_sma(
+                np.ascontiguousarray(np.asarray(high, dtype=np.float64)),
+                np.ascontiguousarray(np.asarray(low, dtype=np.float64)),
+                np.ascontiguousarray(np.asarray(close, dtype=np.float64)),
+                int(period),
+            )
+            return pd.Series(atr, index=close.index)
         tr = np.maximum(
             high - low,
             np.maximum(
@@ -68,7 +126,16 @@ class TechnicalIndicators:
     
     @staticmethod
     def calculate_stochastic(high, low, close, k_period=14, d_period=3):
-        """计算随机指标(KD)"""
+        """计算随机指标(KD)（已安装numba时用单调队列求滚动最高/最低）"""
+        if NUMBA_AVAILABLE:
+            k, d = stochastic(
+                np.ascontiguousarray(np.asarray(high, dtype=np.float64)),
+                np.ascontiguousarray(np.asarray(low, dtype=np.float64)),
+                np.ascontiguousarray(np.asarray(close, dtype=np.float64)),
+                int(k_period), int(d_period)
+            )
+            return pd.Series(k, index=close.index), pd.Series(d, index=close.index)
+        
         lowest_low = low.rolling(window=k_period).min()
         highest_high = high.rolling(window=k_period).max()
         k = 100 * (close - lowest_low) / (highest_high - lowest_low)
@@ -79,7 +146,109 @@ class TechnicalIndicators:
     def calculate_all_indicators(df, params):
         """
         一次性计算所有指标（升级版支持更快EMA）
+        已安装numba时走融合内核，一次遍历OHLC算完全部14列；
+        同一段K线 + 同一组参数重复调用时直接命中缓存
+        """
+        # 缓存键：指标输入（原始float64的 close/high/low）的精确摘要 + 参数
+        # （求和类指纹区分不了单根K线0.05级别的改动，会返回过期指标）
+        prices = np.ascontiguousarray(df[['close', 'high', 'low']].to_numpy(dtype=np.float64))
+        key = (
+            prices.shape,
+            hashlib.blake2b(prices.tobytes(), digest_size=16).digest(),
+            tuple(sorted(params.items())),
+        )
+        
+        outputs = _INDICATOR_CACHE.get(key)
+        if outputs is None:
+            outputs = TechnicalIndicators._compute_indicator_arrays(df, params)
+            _INDICATOR_CACHE[key] = outputs
+            if len(_INDICATOR_CACHE) > _INDICATOR_CACHE_SIZE:
+                _INDICATOR_CACHE.popitem(last=False)
+        else:
+            _INDICATOR_CACHE.move_to_end(key)
+        
+        # 指标列保持float32（送MT5的止损止盈价格由 MT5Connector._price 转回float64）；
+        # 写入副本，避免调用方原地修改污染缓存
+        for col, values in zip(INDICATOR_COLUMNS, outputs):
+            df[col] = values.copy()
+        
+        return df
+    
+    @staticmethod
+    def update_last(df, params, state=None):
+        """
+        实盘增量更新所有指标
+        df: 最新的K线窗口（可以是新构造的DataFrame，只要与上次的K线有重叠）
+        state: 上一次调用返回的状态（含递推状态和上次的指标值）；
+               为None、参数变化或对不上K线时退回全量计算
+        只重算上次最后一根已收盘K线之后的部分：EMA/MACD/RSI 沿用递推状态，
+        布林带/ATR/KD 只回看一个窗口，更早的K线直接复用上次的指标值
+        返回: (df, 新state)
         """
+        params_key = tuple(sorted(params.items()))
+        n = len(df)
+        
+        start = 0
+        rec = np.zeros(REC_SIZE)
+        if state is not None and state['params'] == params_key:
+            loc = df.index.get_indexer([state['last_closed']])[0]
+            # 上次结果中 last_closed 在倒数第二行，对应本次第 loc 行
+            offset = state['values'].shape[1] - 2 - loc
+            if 0 <= loc < n - 1 and offset >= 0:
+                start = loc + 1
+                rec = state['rec'].copy()
+        
+        close = np.ascontiguousarray(df['close'].to_numpy(), dtype=np.float32)
+        high = np.ascontiguousarray(df['high'].to_numpy(), dtype=np.float32)
+        low = np.ascontiguousarray(df['low'].to_numpy(), dtype=np.float32)
+        out = compute_all_tail(close, high, low, TechnicalIndicators._kernel_params(params), start, rec)
+        
+        values = np.empty((len(INDICATOR_COLUMNS), n), dtype=np.float32)
+        if start > 0:
+            values[:, :start] = state['values'][:, offset:offset + start]
+        values[:, start:] = out
+        
+        # 写入副本，调用方原地修改列也不会影响下次增量
+        for col, row in zip(INDICATOR_COLUMNS, values):
+            df[col] = row.copy()
+        
+        new_state = None
+        if n >= 2:
+            new_state = {'params': params_key, 'last_closed': df.index[-2], 'rec': rec,
+                         'values': values}
+        return df, new_state
+    
+    @staticmethod
+    def _compute_indicator_arrays(df, params):
+        """计算全部指标，返回与 INDICATOR_COLUMNS 对应的数组元组"""
+        if not NUMBA_AVAILABLE:
+            result = TechnicalIndicators._calculate_all_indicators_pandas(
+                df[['close', 'high', 'low']].copy(), params
+            )
+            return tuple(result[col].to_numpy(dtype=np.float32) for col in INDICATOR_COLUMNS)
+        
+        # float32只作融合内核的输入：黄金价格精度（0.01）float32足够，内存带宽减半
+        # （缓存键在调用方用原始float64数据计算，不受这里的精度损失影响）
+        close = np.ascontiguousarray(df['close'].to_numpy(), dtype=np.float32)
+        high = np.ascontiguousarray(df['high'].to_numpy(), dtype=np.float32)
+        low = np.ascontiguousarray(df['low'].to_numpy(), dtype=np.float32)
+        return compute_all(close, high, low, TechnicalIndicators._kernel_params(params))
+    
+    @staticmethod
+    def _kernel_params(params):
+        """STRATEGY_PARAMS -> 融合内核的参数元组"""
+        return (
+            int(params['ema_short']), int(params['ema_medium']), int(params['ema_long']),
+            int(params['rsi_period']),
+            int(params['macd_fast']), int(params['macd_slow']), int(params['macd_signal']),
+            int(params['bb_period']), float(params['bb_std']),
+            int(params['atr_period']),
+            10, 14, 3,  # 动量周期、KD的k/d周期（同下方pandas实现的默认值）
+        )
+    
+    @staticmethod
+    def _calculate_all_indicators_pandas(df, params):
+        """逐项pandas计算所有指标（未安装numba时使用）"""
         close = df['close']
         high = df['high']
         low = df['low']
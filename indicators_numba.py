@@ -0,0 +1,486 @@
+"""
+indicators_numba.py - 全部技术指标的Numba融合内核
+一次遍历 close/high/low 同时维护 EMA×3、RSI、MACD、布林带、ATR、动量、KD 的状态，
+取代原来十几次各自独立的 pandas ewm/rolling 扫描
+数值口径与 TechnicalIndicators 中各单项指标完全一致（包括前期NaN的位置）
+所有内核都带显式签名（float32/float64两套），导入时即编译或读磁盘缓存
+"""
+
+import math
+import numpy as np
+from _njit import njit
+
+N_OUTPUTS = 14  # compute_all 输出的指标个数
+# 增量更新的递推状态: [EMA短, EMA中, EMA长, MACD快线EMA, MACD慢线EMA, MACD信号线, RSI平均涨幅, RSI平均跌幅]
+REC_SIZE = 8
+
+# compute_all 的 params 元组：9个周期 + bb_std(float) + 3个周期
+_PARAMS_T = 'Tuple((' + ', '.join(['int64'] * 8 + ['float64'] + ['int64'] * 4) + '))'
+# 输入声明为只读：pandas写时复制模式下 .values 返回只读数组，可写数组也能传入
+_IN = "Array({0}, 1, 'C', readonly=True)"
+_INTO_SIGS = [
+    'void({1}, {1}, {1}, {2}, {0}[:, ::1], int64, float64[::1])'.format(dt, _IN.format(dt), _PARAMS_T)
+    for dt in ('float32', 'float64')
+]
+_TAIL_SIGS = [
+    '{0}[:, ::1]({1}, {1}, {1}, {2}, int64, float64[::1])'.format(dt, _IN.format(dt), _PARAMS_T)
+    for dt in ('float32', 'float64')
+]
+_COMPUTE_ALL_SIGS = [
+    'UniTuple({0}[::1], 14)({1}, {1}, {1}, {2})'.format(dt, _IN.format(dt), _PARAMS_T)
+    for dt in ('float32', 'float64')
+]
+_BB_SIGS = [
+    'UniTuple(float64[::1], 3)({0}, int64, float64)'.format(_IN.format(dt))
+    for dt in ('float32', 'float64')
+]
+_RSI_SIGS = [
+    'float64[::1]({0}, int64)'.format(_IN.format(dt))
+    for dt in ('float32', 'float64')
+]
+_ATR_SIGS = [
+    'float64[::1]({0}, {0}, {0}, int64)'.format(_IN.format(dt))
+    for dt in ('float32', 'float64')
+]
+_STOCH_SIGS = [
+    'UniTuple(float64[::1], 2)({0}, {0}, {0}, int64, int64)'.format(_IN.format(dt))
+    for dt in ('float32', 'float64')
+]
+
+
+@njit(_INTO_SIGS, cache=True, boundscheck=False)
+def _compute_all_into(close, high, low, params, out, start, rec):
+    """
+    融合计算所有指标，结果写入 out（形状 (14, n-start)，行顺序同 INDICATOR_COLUMNS，
+    第j列对应第 start+j 根K线）
+    params: (ema_short, ema_medium, ema_long, rsi_period,
+             macd_fast, macd_slow, macd_signal,
+             bb_period, bb_std, atr_period,
+             mom_period, k_period, d_period)
+    start: 从第几根K线开始输出；start>0 时只算尾部（实盘增量更新）：
+           EMA/MACD/RSI 的递推状态从 rec 读入（第 start-1 根处的状态），
+           布林带/ATR/KD 等窗口指标从 start 之前一个窗口的K线重新预热
+    rec: 长度 REC_SIZE 的float64数组，返回时写入倒数第二根K线处的递推状态
+         （最后一根可能尚未收盘），供下一次增量更新
+    输入可以是 float32（省一半内存带宽），递推状态始终用 float64 累加
+    """
+    (ema_short, ema_medium, ema_long, rsi_period,
+     macd_fast, macd_slow, macd_signal,
+     bb_period, bb_std, atr_period,
+     mom_period, k_period, d_period) = params
+
+    n = close.shape[0]
+    nan = np.nan
+
+    ema_s = out[0]
+    ema_m = out[1]
+    ema_l = out[2]
+    rsi = out[3]
+    macd = out[4]
+    macd_sig = out[5]
+    macd_hist = out[6]
+    bb_upper = out[7]
+    bb_middle = out[8]
+    bb_lower = out[9]
+    atr = out[10]
+    mom = out[11]
+    stoch_k = out[12]
+    stoch_d = out[13]
+
+    if n == 0 or start >= n:
+        return
+
+    # EMA平滑系数（span口径）
+    a_s = 2.0 / (ema_short + 1)
+    a_m = 2.0 / (ema_medium + 1)
+    a_l = 2.0 / (ema_long + 1)
+    a_f = 2.0 / (macd_fast + 1)
+    a_sl = 2.0 / (macd_slow + 1)
+    a_sig = 2.0 / (macd_signal + 1)
+    a_rsi = 1.0 / rsi_period
+
+    if start == 0:
+        # EMA / MACD 递推状态（第一根K线作种子，float64累加）
+        c0 = float(close[0])
+        e_s = c0
+        e_m = c0
+        e_l = c0
+        e_f = c0
+        e_sl = c0
+        e_sig = 0.0
+        # RSI：涨跌幅的Wilder平滑（从0起算，同lfilter零初始状态）
+        avg_gain = 0.0
+        avg_loss = 0.0
+    else:
+        e_s = rec[0]
+        e_m = rec[1]
+        e_l = rec[2]
+        e_f = rec[3]
+        e_sl = rec[4]
+        e_sig = rec[5]
+        avg_gain = rec[6]
+        avg_loss = rec[7]
+
+    # 窗口指标从 w0 开始预热（w0 之前的K线已不在任何窗口内）
+    w0 = max(0, start - max(bb_period, atr_period + 1, k_period + d_period))
+
+    # 布林带：滑动窗口Welford均值/方差
+    bb_buf = np.zeros(bb_period)
+    bb_mean = 0.0
+    bb_m2 = 0.0
+
+    # ATR：TR滚动窗口
+    tr_buf = np.zeros(atr_period)
+    tr_sum = 0.0
+    tr_count = 0
+
+    # KD：单调队列求滚动最高/最低
+    dq_max = np.zeros(k_period, dtype=np.int64)
+    dq_min = np.zeros(k_period, dtype=np.int64)
+    max_head = 0
+    max_size = 0
+    min_head = 0
+    min_size = 0
+    k_hist = np.zeros(d_period)  # 最近d_period个K值（float64，算D用）
+
+    for i in range(w0, n):
+        c = float(close[i])
+        h = float(high[i])
+        l = float(low[i])
+        rel = i - w0    # 窗口指标的相对下标
+        j = i - start   # 输出列下标（<0 为预热段，不输出）
+
+        if j >= 0:
+            # ---------- EMA ----------
+            if i > 0:
+                e_s = (1.0 - a_s) * e_s + a_s * c
+                e_m = (1.0 - a_m) * e_m + a_m * c
+                e_l = (1.0 - a_l) * e_l + a_l * c
+                e_f = (1.0 - a_f) * e_f + a_f * c
+                e_sl = (1.0 - a_sl) * e_sl + a_sl * c
+            ema_s[j] = e_s
+            ema_m[j] = e_m
+            ema_l[j] = e_l
+
+            # ---------- MACD ----------
+            m = e_f - e_sl
+            if i == 0:
+                e_sig = m
+            else:
+                e_sig = (1.0 - a_sig) * e_sig + a_sig * m
+            macd[j] = m
+            macd_sig[j] = e_sig
+            macd_hist[j] = m - e_sig
+
+            # ---------- RSI（Wilder平滑）----------
+            g = 0.0
+            ls = 0.0
+            if i > 0:
+                d = c - float(close[i - 1])
+                if d > 0.0:
+                    g = d
+                elif d < 0.0:
+                    ls = -d
+            avg_gain = (1.0 - a_rsi) * avg_gain + a_rsi * g
+            avg_loss = (1.0 - a_rsi) * avg_loss + a_rsi * ls
+            if i >= rsi_period - 1:
+                rsi[j] = 100.0 - 100.0 / (1.0 + avg_gain / max(avg_loss, 1e-12))
+            else:
+                rsi[j] = nan
+
+            if i == n - 2:
+                rec[0] = e_s
+                rec[1] = e_m
+                rec[2] = e_l
+                rec[3] = e_f
+                rec[4] = e_sl
+                rec[5] = e_sig
+                rec[6] = avg_gain
+                rec[7] = avg_loss
+
+        # ---------- 布林带（样本标准差 ddof=1）----------
+        slot = rel % bb_period
+        if rel < bb_period:
+            delta = c - bb_mean
+            bb_mean += delta / (rel + 1)
+            bb_m2 += delta * (c - bb_mean)
+        else:
+            old = bb_buf[slot]
+            old_mean = bb_mean
+            delta = c - old
+            bb_mean += delta / bb_period
+            bb_m2 += delta * (c - bb_mean + old - old_mean)
+        bb_buf[slot] = c
+        if j >= 0:
+            if i >= bb_period - 1 and bb_period > 1:
+                var = bb_m2 / (bb_period - 1)
+                sd = math.sqrt(var) if var > 0.0 else 0.0
+                bb_middle[j] = bb_mean
+                bb_upper[j] = bb_mean + sd * bb_std
+                bb_lower[j] = bb_mean - sd * bb_std
+            else:
+                bb_middle[j] = nan
+                bb_upper[j] = nan
+                bb_lower[j] = nan
+
+        # ---------- ATR（TR的简单滚动均值，第一根TR为NaN）----------
+        if i > 0:
+            cp = float(close[i - 1])
+            tr = h - l
+            if abs(h - cp) > tr:
+                tr = abs(h - cp)
+            if abs(l - cp) > tr:
+                tr = abs(l - cp)
+            slot = tr_count % atr_period
+            if tr_count >= atr_period:
+                tr_sum -= tr_buf[slot]
+            tr_buf[slot] = tr
+            tr_sum += tr
+            tr_count += 1
+        if j >= 0:
+            if i >= atr_period:
+                atr[j] = tr_sum / atr_period
+            else:
+                atr[j] = nan
+
+            # ---------- 动量 ----------
+            if i >= mom_period:
+                mom[j] = c - float(close[i - mom_period])
+            else:
+                mom[j] = nan
+
+        # ---------- KD ----------
+        # 先弹出窗口外的队首，再维护队尾单调性
+        if max_size > 0 and dq_max[max_head] <= i - k_period:
+            max_head = (max_head + 1) % k_period
+            max_size -= 1
+        while max_size > 0 and high[dq_max[(max_head + max_size - 1) % k_period]] <= h:
+            max_size -= 1
+        dq_max[(max_head + max_size) % k_period] = i
+        max_size += 1
+
+        if min_size > 0 and dq_min[min_head] <= i - k_period:
+            min_head = (min_head + 1) % k_period
+            min_size -= 1
+        while min_size > 0 and low[dq_min[(min_head + min_size - 1) % k_period]] >= l:
+            min_size -= 1
+        dq_min[(min_head + min_size) % k_period] = i
+        min_size += 1
+
+        if i >= k_period - 1:
+            hh = float(high[dq_max[max_head]])
+            ll = float(low[dq_min[min_head]])
+            num = 100.0 * (c - ll)
+            den = hh - ll
+            if den != 0.0:
+                k_val = num / den
+            elif num == 0.0:
+                k_val = nan
+            else:
+                k_val = math.copysign(np.inf, num)
+        else:
+            k_val = nan
+        k_hist[i % d_period] = k_val
+
+        if j >= 0:
+            stoch_k[j] = k_val
+            if i >= k_period + d_period - 2:
+                s = 0.0
+                for t in range(d_period):
+                    s += k_hist[t]
+                stoch_d[j] = s / d_period
+            else:
+                stoch_d[j] = nan
+
+
+@njit(_COMPUTE_ALL_SIGS, cache=True, boundscheck=False)
+def compute_all(close, high, low, params):
+    """
+    融合计算所有指标（单品种）
+    params 同 _compute_all_into；输出数组与输入同dtype
+    返回: 14个数组，顺序同 INDICATOR_COLUMNS
+    """
+    out = np.empty((N_OUTPUTS, close.shape[0]), dtype=close.dtype)
+    _compute_all_into(close, high, low, params, out, 0, np.empty(REC_SIZE))
+    return (out[0], out[1], out[2], out[3], out[4], out[5], out[6],
+            out[7], out[8], out[9], out[10], out[11], out[12], out[13])
+
+
+@njit(_TAIL_SIGS, cache=True, boundscheck=False)
+def compute_all_tail(close, high, low, params, start, rec):
+    """
+    增量计算：只输出第 start 根及之后K线的指标（形状 (14, n-start)）
+    rec 传入第 start-1 根K线处的递推状态，返回时原地更新为倒数第二根K线处的状态；
+    start=0 时等价于全量计算（rec 只作输出）
+    """
+    n = close.shape[0]
+    out = np.empty((N_OUTPUTS, max(n - start, 0)), dtype=close.dtype)
+    _compute_all_into(close, high, low, params, out, start, rec)
+    return out
+
+
+@njit(_RSI_SIGS, cache=True, boundscheck=False)
+def rsi_wilder(x, period):
+    """
+    RSI（涨跌幅的Wilder平滑，从0起算）单次循环
+    与 lfilter 实现口径一致：前 period-1 根为NaN，平均跌幅下限1e-12
+    """
+    n = x.shape[0]
+    rsi = np.empty(n)
+    a = 1.0 / period
+    avg_gain = 0.0
+    avg_loss = 0.0
+    for i in range(n):
+        g = 0.0
+        ls = 0.0
+        if i > 0:
+            d = float(x[i]) - float(x[i - 1])
+            if d > 0.0:
+                g = d
+            elif d < 0.0:
+                ls = -d
+        avg_gain = (1.0 - a) * avg_gain + a * g
+        avg_loss = (1.0 - a) * avg_loss + a * ls
+        if i >= period - 1:
+            rsi[i] = 100.0 - 100.0 / (1.0 + avg_gain / max(avg_loss, 1e-12))
+        else:
+            rsi[i] = np.nan
+    return rsi
+
+
+@njit(_ATR_SIGS, cache=True, boundscheck=False)
+def atr_sma(high, low, close, period):
+    """
+    ATR（TR的简单滚动均值）单次循环，TR环形缓冲维护滚动和
+    第一根TR为NaN，前 period 根ATR为NaN（同pandas rolling实现）
+    """
+    n = close.shape[0]
+    atr = np.full(n, np.nan)
+    buf = np.zeros(period)
+    tr_sum = 0.0
+    for i in range(1, n):
+        h = float(high[i])
+        l = float(low[i])
+        cp = float(close[i - 1])
+        tr = h - l
+        if abs(h - cp) > tr:
+            tr = abs(h - cp)
+        if abs(l - cp) > tr:
+            tr = abs(l - cp)
+        slot = (i - 1) % period
+        if i - 1 >= period:
+            tr_sum -= buf[slot]
+        buf[slot] = tr
+        tr_sum += tr
+        if i >= period:
+            atr[i] = tr_sum / period
+    return atr
+
+
+@njit(_BB_SIGS, cache=True, boundscheck=False)
+def bollinger_bands(x, period, num_std):
+    """
+    布林带单次遍历：滑动窗口Welford同时得到均值和样本标准差（ddof=1，同pandas rolling.std）
+    返回: (upper, middle, lower)，前 period-1 根为NaN
+    """
+    n = x.shape[0]
+    upper = np.full(n, np.nan)
+    middle = np.full(n, np.nan)
+    lower = np.full(n, np.nan)
+    if period < 2:
+        return upper, middle, lower
+
+    buf = np.zeros(period)
+    mean = 0.0
+    m2 = 0.0
+    for i in range(n):
+        c = x[i]
+        slot = i % period
+        if i < period:
+            delta = c - mean
+            mean += delta / (i + 1)
+            m2 += delta * (c - mean)
+        else:
+            old = buf[slot]
+            old_mean = mean
+            delta = c - old
+            mean += delta / period
+            m2 += delta * (c - mean + old - old_mean)
+        buf[slot] = c
+        if i >= period - 1:
+            var = m2 / (period - 1)
+            sd = math.sqrt(var) if var > 0.0 else 0.0
+            middle[i] = mean
+            upper[i] = mean + sd * num_std
+            lower[i] = mean - sd * num_std
+
+    return upper, middle, lower
+
+
+@njit(_STOCH_SIGS, cache=True, boundscheck=False)
+def stochastic(high, low, close, k_period, d_period):
+    """
+    KD指标：两个单调队列（索引环形缓冲）求滚动最高/最低，均摊O(1)
+    返回: (k, d)，NaN位置与pandas rolling实现一致
+    """
+    n = close.shape[0]
+    k = np.full(n, np.nan)
+    d = np.full(n, np.nan)
+
+    dq_max = np.zeros(k_period, dtype=np.int64)
+    dq_min = np.zeros(k_period, dtype=np.int64)
+    max_head = 0
+    max_size = 0
+    min_head = 0
+    min_size = 0
+    d_sum = 0.0
+
+    for i in range(n):
+        # 先弹出窗口外的队首，再维护队尾单调性
+        if max_size > 0 and dq_max[max_head] <= i - k_period:
+            max_head = (max_head + 1) % k_period
+            max_size -= 1
+        while max_size > 0 and high[dq_max[(max_head + max_size - 1) % k_period]] <= high[i]:
+            max_size -= 1
+        dq_max[(max_head + max_size) % k_period] = i
+        max_size += 1
+
+        if min_size > 0 and dq_min[min_head] <= i - k_period:
+            min_head = (min_head + 1) % k_period
+            min_size -= 1
+        while min_size > 0 and low[dq_min[(min_head + min_size - 1) % k_period]] >= low[i]:
+            min_size -= 1
+        dq_min[(min_head + min_size) % k_period] = i
+        min_size += 1
+
+        if i >= k_period - 1:
+            hh = high[dq_max[max_head]]
+            ll = low[dq_min[min_head]]
+            num = 100.0 * (close[i] - ll)
+            den = hh - ll
+            if den != 0.0:
+                k[i] = num / den
+            elif num != 0.0:
+                k[i] = math.copysign(np.inf, num)
+
+        # D：K的d_period滚动均值（窗口内有NaN则为NaN）
+        if i >= k_period + d_period - 2:
+            d_sum = 0.0
+            for t in range(i - d_period + 1, i + 1):
+                d_sum += k[t]
+            d[i] = d_sum / d_period
+
+    return k, d
+
+
+def prewarm():
+    """用64根假K线跑一遍所有内核，确保编译结果/磁盘缓存在第一个交易周期前就绪"""
+    x = np.linspace(1.0, 2.0, 64)
+    params = (8, 21, 100, 14, 12, 26, 9, 20, 2.0, 14, 10, 14, 3)
+    for arr in (x.astype(np.float32), x):
+        compute_all(arr, arr + 0.5, arr - 0.5, params)
+        compute_all_tail(arr, arr + 0.5, arr - 0.5, params, 60, np.zeros(REC_SIZE))
+        rsi_wilder(arr, 14)
+        atr_sma(arr + 0.5, arr - 0.5, arr, 14)
+        bollinger_bands(arr, 20, 2.0)
+        stochastic(arr + 0.5, arr - 0.5, arr, 14, 3)
@@ -2,10 +2,13 @@
 日志记录模块
 """
 
+import atexit
+import csv
 import logging
 import sys
 from datetime import datetime
-import os
+
+CSV_FLUSH_ROWS = 10  # 交易CSV每累计多少行flush一次
 
 class TradingLogger:
     """交易日志记录器"""
@@ -14,6 +17,9 @@ class TradingLogger:
         self.config = config
         self.logger = None
         self.log_file = None
+        self._csv_file = None
+        self._csv = None
+        self._csv_pending = 0
         self.setup_logger()
         
         # 交易统计
@@ -59,6 +65,21 @@ class TradingLogger:
         )
         console_handler.setFormatter(console_formatter)
         self.logger.addHandler(console_handler)
+        
+        # 交易CSV：整个生命周期只打开一次，带缓冲写入，退出时flush并关闭
+        if self._csv_file is None:
+            try:
+                self._csv_file = open('trades.csv', 'a', buffering=1 << 16,
+                                      newline='', encoding='utf-8')
+                self._csv = csv.writer(self._csv_file)
+                if self._csv_file.tell() == 0:
+                    self._csv.writerow(['时间', '动作', '详情', '盈亏'])
+                    self._csv_file.flush()
+                atexit.register(self.close)
+            except Exception as e:
+                self._csv_file = None
+                self._csv = None
+                self.logger.error(f"CSV文件打开失败: {e}")
     
     def log_system(self, message):
         """系统日志"""
@@ -95,21 +116,33 @@ class TradingLogger:
         self.logger.debug(f"💰 {symbol}: {bid:.2f}/{ask:.2f} (点差: {spread:.2f})")
     
     def _log_to_csv(self, action, details):
-        """记录到CSV文件"""
+        """记录到CSV文件（写入缓冲区，每CSV_FLUSH_ROWS行flush一次）"""
+        if self._csv is None:
+            return
         try:
-            csv_file = 'trades.csv'
-            file_exists = os.path.exists(csv_file)
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self._csv.writerow([timestamp, action, details, 0])
             
-            with open(csv_file, 'a', encoding='utf-8') as f:
-                if not file_exists:
-                    f.write("时间,动作,详情,盈亏\n")
-                
-                timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                f.write(f"{timestamp},{action},{details},0\n")
+            self._csv_pending += 1
+            if self._csv_pending >= CSV_FLUSH_ROWS:
+                self._csv_file.flush()
+                self._csv_pending = 0
                 
         except Exception as e:
             self.logger.error(f"CSV记录失败: {e}")
     
+    def close(self):
+        """flush并关闭交易CSV文件（程序退出时自动调用）"""
+        if self._csv_file is not None:
+            try:
+                self._csv_file.flush()
+                self._csv_file.close()
+            except Exception:
+                pass
+            self._csv_file = None
+            self._csv = None
+            self._csv_pending = 0
+    
     def get_daily_summary(self):
         """获取当日摘要"""
         win_rate = (self.win_count / self.trade_count * 100) if self.trade_count > 0 else 0
@@ -8,7 +8,17 @@
 + 修复show_config中max_positions未定义bug
 """
 
+import contextlib
+import io
+import itertools
+import math
+import os
+import queue
+import signal as os_signal  # 避免与主循环里的交易信号变量 signal 重名
+import sys
+import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from datetime import datetime, timedelta
 import pandas as pd
 import MetaTrader5 as mt5
@@ -17,18 +27,85 @@ import numpy as np  # 用于NaN检查
 # 导入所有模块
 from config import *
 from indicators import TechnicalIndicators
-from strategies import TradingStrategies
-from risk_manager import RiskManager
+from indicators_numba import prewarm as prewarm_indicators
+from strategies import TradingStrategies, STRATEGY_NAMES, VOTE_LABELS, VOTE_EMOJIS
+from risk_manager import RiskManager, STOP_UNCHANGED, STOP_BREAKEVEN, TRAIL_ATR_MULT
 from mt5_connector import MT5Connector
+from _bt_kernel import run_bar, trade_pnl, BacktestPositions, ADJ_BE, ADJ_TRAIL, CLOSE_REASONS
 
 # 导入ADX分析器
-from adx_analyzer import MarketAnalysis
+from adx_analyzer import ADXAnalyzer, MarketAnalysis, prewarm as prewarm_adx
 
 # 导入专业策略模块
 from professional_ranging import ProfessionalRangingStrategy
 from professional_executor import ProfessionalExecutor
 from stops_implementation import ProfessionalStopsManager
 
+# 实盘每周期需要的最新K线字段（一次性取成标量dict）
+LATEST_COLUMNS = ('open', 'high', 'low', 'close', 'ATR', 'RSI', 'MACD_hist')
+
+BACKTEST_SPREAD = 0.3  # 回测点差（黄金典型点差）
+REPORT_MIN_TRADES = 10  # 交易笔数少于此数时回测只输出一行简要结果
+LOT_MULTIPLIER = {'RANGING': 1.0, 'TRENDING': 1.2}  # 手数倍数：震荡1.0倍，趋势1.2倍
+
+# 回测交易记录的列（逐笔平仓只存一个按此顺序的元组，回测结束后一次建成DataFrame）
+TRADE_FIELDS = (
+    '序号', '时间', '方向', '开仓价', '实际开仓价', '平仓价', '实际平仓价', '平仓时间', '手数',
+    '初始止损', '最终止损', '止盈价', '盈亏金额', '盈亏百分比', '平仓原因', '持仓时间',
+    'ATR开仓时', 'ATR平仓时', '保本触发', '止损调整次数', '调整详情', '当时余额', '点差成本',
+    '市场类型', '信号信心度',
+)
+
+# 回测按市场类型分组统计时的行下标
+MARKET_TYPES = ('RANGING', 'TRENDING')
+MARKET_INDEX = {market_type: j for j, market_type in enumerate(MARKET_TYPES)}
+
+# 市场类型 -> 报告里的名称 / 状态面板的策略描述（只读查表）
+MARKET_NAMES = {'RANGING': '双边网格', 'TRENDING': '单边趋势'}
+# identify_market_type_vec 的市场编码（0=盘整/1=趋势开始/2=强单边）-> 市场类型 / 描述
+MARKET_CODE_TYPES = ('RANGING', 'TRENDING', 'TRENDING')
+MARKET_CODE_DESCS = ('盘整/双边', '趋势开始', '强单边')
+SIGNAL_TEXTS = {1: '🟢 买入', -1: '🔴 卖出', 0: '⚪ 无信号'}  # 交易信号 -> 状态面板文字
+STRATEGY_DESCRIPTIONS = {
+    'RANGING': {
+        'name': '统计套利网格交易',
+        'description': 'ADX < 20，市场盘整，使用双边网格策略',
+        'icon': '🔄'
+    },
+    'TRENDING': {
+        'name': '趋势跟随策略',
+        'description': 'ADX ≥ 20，市场有趋势，使用单边趋势策略',
+        'icon': '📈'
+    },
+}
+
+# 实盘K线窗口根数（MT5Connector内部用环形缓冲增量更新）
+HISTORY_BARS = 600
+BAR_CLOSE_DELAY = 2  # K线收盘后多等几秒再取数据，确保新K线已生成
+POSITION_CHECK_INTERVAL = 60  # 等待K线收盘期间，持仓管理（保本/移动止损）的运行间隔（秒）
+
+
+class _QueueWriter:
+    """
+    实盘主循环期间替换 sys.stdout：各模块、各线程（含批量改单的线程池）的输出
+    按发生顺序与状态面板一起入队，由 TradingBot._drain_log 统一写出
+    """
+    
+    def __init__(self, q):
+        self.q = q
+    
+    def write(self, text):
+        self.q.put(text)
+        return len(text)
+    
+    def flush(self):
+        pass
+
+def _latest_atr(latest, default):
+    """从最新K线字段dict里取ATR（缺失或NaN时用 default），标量直接用 math.isnan 判断"""
+    atr = latest.get('ATR')
+    return default if atr is None or math.isnan(atr) else atr
+
 class AdaptiveStrategyManager:
     """自适应策略管理器"""
     
@@ -38,17 +115,53 @@ class AdaptiveStrategyManager:
         self.executor = ProfessionalExecutor(initial_capital)
         self.stops_manager = ProfessionalStopsManager()
         
-        # ADX阈值
-        self.adx_threshold = 20
+        # ADX阈值（与 CONFIG_BANNER 显示的一致）
+        self.adx_threshold = ADX_CONFIG['adx_threshold']
+        # 趋势模式止损/止盈的ATR倍数，每次开仓都要用，先取出来
+        self.atr_sl_mult = STRATEGY_PARAMS['atr_multiplier_sl']
+        self.atr_tp_mult = STRATEGY_PARAMS['atr_multiplier_tp']
         
         # 当前状态
         self.current_market_type = None
         self.last_adx = 0
         self.adx_history = []
         
+        # 常驻ADX分析器：新K线只增量更新ADX，不再每次全量重算
+        self.market_analysis = MarketAnalysis(None, adx_threshold=self.adx_threshold)
+        
     def analyze_market(self, df):
-        """分析市场状态 - 修复：安全处理数据不足和NaN"""
-        if len(df) < 80:  # 数据不足时返回安全默认
+        """分析市场状态（实盘：增量更新ADX后只取最新一行）"""
+        # 数据不足时不算ADX，由 analyze_market_row 返回安全默认
+        df_with_adx = self.market_analysis.analyze(df) if len(df) >= 80 else df
+        market_info = self.analyze_market_row(df_with_adx, len(df) - 1)
+        market_info['df'] = df_with_adx
+        return market_info
+    
+    def precompute_adx(self, df):
+        """
+        回测用：整段K线一次性算出 ADX/+DI/-DI 并作为列写回 df（Wilder递推本身是因果的，
+        第i行与只用前i+1根K线算出的值一致），之后逐K线用 analyze_market_row 按行取值
+        """
+        adx, pos_di, neg_di = ADXAnalyzer(period=14, adx_threshold=self.adx_threshold).calculate_adx(
+            df['high'], df['low'], df['close']
+        )
+        df['ADX'] = adx
+        df['+DI'] = pos_di
+        df['-DI'] = neg_di
+        return df
+    
+    @staticmethod
+    def adx_arrays(df):
+        """ADX/+DI/-DI 三列的ndarray视图（缺失的列为None），回测时取一次供逐K线按下标读取"""
+        return tuple(df[col].to_numpy() if col in df.columns else None for col in ('ADX', '+DI', '-DI'))
+    
+    def analyze_market_row(self, df, i, adx_cols=None, market_codes=None):
+        """
+        第 i 根K线的市场状态（df 需已含 ADX/+DI/-DI 列）- 安全处理数据不足和NaN
+        adx_cols: adx_arrays(df) 的结果，逐K线调用时传入可省去每次的列查找
+        market_codes: identify_market_type_vec 整段打好的市场编码，传入时直接查表，不再逐行判断
+        """
+        if i + 1 < 80:  # 数据不足时返回安全默认
             print("⚠️  K线数据不足（<80根），无法计算ADX，使用默认RANGING模式")
             return {
                 'market_type': 'RANGING',
@@ -58,25 +171,28 @@ class AdaptiveStrategyManager:
                 'adx': 0.0,
                 '+DI': 0.0,
                 '-DI': 0.0,
-                'df': df
             }
         
-        # 计算ADX
-        analyzer = MarketAnalysis(df)
-        df_with_adx = analyzer.analyze()
-        latest = df_with_adx.iloc[-1]
-        
-        # 安全取值：处理缺失列和NaN
-        adx_value = latest['ADX'] if 'ADX' in latest and pd.notna(latest['ADX']) else 0.0
-        pos_di = latest['+DI'] if '+DI' in latest and pd.notna(latest['+DI']) else 0.0
-        neg_di = latest['-DI'] if '-DI' in latest and pd.notna(latest['-DI']) else 0.0
+        # 安全取值：处理缺失列和NaN（直接按下标取ndarray元素，转成Python float）
+        adx_arr, pos_arr, neg_arr = adx_cols if adx_cols is not None else self.adx_arrays(df)
+        adx_value = float(adx_arr[i]) if adx_arr is not None else 0.0
+        pos_di = float(pos_arr[i]) if pos_arr is not None else 0.0
+        neg_di = float(neg_arr[i]) if neg_arr is not None else 0.0
+        if math.isnan(pos_di):
+            pos_di = 0.0
+        if math.isnan(neg_di):
+            neg_di = 0.0
         
-        if np.isnan(adx_value):
+        if math.isnan(adx_value):
             print("⚠️  ADX计算为NaN，使用默认值0")
             adx_value = 0.0
         
-        # 判断市场类型
-        if adx_value < self.adx_threshold:
+        # 判断市场类型（回测已批量打好标签时直接查表）
+        if market_codes is not None:
+            code = market_codes[i]
+            market_type = MARKET_CODE_TYPES[code]
+            market_desc = MARKET_CODE_DESCS[code]
+        elif adx_value < self.adx_threshold:
             market_type = 'RANGING'
             market_desc = '盘整/双边'
         else:
@@ -108,7 +224,6 @@ class AdaptiveStrategyManager:
             'adx': adx_value,
             '+DI': pos_di,
             '-DI': neg_di,
-            'df': df_with_adx
         }
     
     def generate_signal(self, df):
@@ -123,7 +238,7 @@ class AdaptiveStrategyManager:
             # 网格管理
             grid_info = details.get('grid_info', None) if details else None
             position_action, lot_size, grid_details = self.executor.manage_grid_positions(
-                df['close'].iloc[-1], grid_info, signal, confidence
+                df['close'].iat[-1], grid_info, signal, confidence
             )
             
             details['grid_action'] = position_action
@@ -140,7 +255,7 @@ class AdaptiveStrategyManager:
             
         else:  # TRENDING
             # 单边策略：原有趋势跟随策略
-            signal, strategy_votes = TradingStrategies.generate_combined_signal(df, STRATEGY_PARAMS)
+            signal, strategy_votes = TradingStrategies.generate_latest_signal(df, STRATEGY_PARAMS)
             
             details = {
                 'strategy_votes': strategy_votes,
@@ -156,9 +271,74 @@ class AdaptiveStrategyManager:
                 'market_info': market_info
             }
     
-    def calculate_stops(self, signal, entry_price, df, market_type, grid_info=None):
-        """计算止损止盈"""
-        atr = df['ATR'].iloc[-1] if 'ATR' in df.columns and pd.notna(df['ATR'].iloc[-1]) else 10
+    def generate_signal_vectorized(self, df):
+        """
+        回测用：整段K线一次性预计算信号所需的全部数据，之后逐K线 generate_signal_at 只做O(1)取值
+        - ADX/+DI/-DI 整段算一次，作为列写回 df（见 precompute_adx）
+        - 市场类型用 identify_market_type_vec 整段打整数标签，逐K线只查表
+        - 趋势策略四项投票整列向量化
+        - 网格策略的滚动统计量整列算好；冷却、连续跳过计数等依赖前一根结果的状态仍逐K线推进
+        - trend_idle：趋势市且趋势信号为0的K线（generate_signal_at 必然给出0信号，且不推进任何状态）
+        返回: 预计算结果dict
+        """
+        self.precompute_adx(df)
+        # ADX为NaN时比较为False，编码为0（盘整），与逐行判断时NaN按0处理一致
+        market_code = self.market_analysis.analyzer.identify_market_type_vec(
+            df['ADX'], df['+DI'], df['-DI']
+        )['market_code']
+        trend_signal, trend_votes = TradingStrategies.generate_signals_vectorized(df, STRATEGY_PARAMS)
+        trending = (np.arange(len(df)) >= 79) & (market_code > 0)
+        return {
+            'trend_signal': trend_signal,
+            'trend_votes': trend_votes,
+            'trend_idle': trending & (trend_signal == 0),
+            'ranging': self.ranging_strategy.precompute_features(df),
+            'adx_cols': self.adx_arrays(df),
+            'market_code': market_code.tolist(),  # 逐K线按下标取Python int，直接作查找表下标
+        }
+    
+    def generate_signal_at(self, df, i, pre):
+        """
+        第 i 根K线的交易信号（df、pre 为调用过 generate_signal_vectorized 的数据和其结果）
+        与对 df.iloc[:i+1] 调用 generate_signal 的结果一致，但不切片、不重算指标
+        """
+        market_info = self.analyze_market_row(df, i, pre['adx_cols'], pre['market_code'])
+        market_type = market_info['market_type']
+        
+        if market_type == 'RANGING':
+            features = pre['ranging']
+            signal, confidence, details = self.ranging_strategy.generate_signal_at(i, features)
+            
+            grid_info = details.get('grid_info', None) if details else None
+            position_action, lot_size, grid_details = self.executor.manage_grid_positions(
+                features['close'][i], grid_info, signal, confidence
+            )
+            details['grid_action'] = position_action
+            details['grid_lot_size'] = lot_size
+            details['grid_details'] = grid_details
+        else:
+            signal = int(pre['trend_signal'][i])
+            confidence = market_info['adx'] / 50.0
+            details = {
+                'strategy_votes': dict(zip(STRATEGY_NAMES, pre['trend_votes'][i].tolist())),
+                'market_desc': market_info['market_desc'],
+                'direction': market_info['direction']
+            }
+        
+        return {
+            'signal': signal,
+            'confidence': confidence,
+            'market_type': market_type,
+            'details': details,
+            'market_info': market_info
+        }
+    
+    def calculate_stops(self, signal, entry_price, latest, market_type, grid_info=None):
+        """
+        计算止损止盈
+        latest: 最新K线的字段（实盘为 _latest_values 的dict，回测为只含ATR的dict）
+        """
+        atr = _latest_atr(latest, 10)
         
         if market_type == 'RANGING':
             if grid_info and 'grid_width' in grid_info:
@@ -169,8 +349,8 @@ class AdaptiveStrategyManager:
                 sl_distance = atr * 1.5
                 tp_distance = atr * 2.5
         else:
-            sl_distance = atr * STRATEGY_PARAMS['atr_multiplier_sl']
-            tp_distance = atr * STRATEGY_PARAMS['atr_multiplier_tp']
+            sl_distance = atr * self.atr_sl_mult
+            tp_distance = atr * self.atr_tp_mult
         
         if signal == 1:
             sl = entry_price - sl_distance
@@ -188,23 +368,19 @@ class AdaptiveStrategyManager:
         }
     
     def get_strategy_description(self, market_type):
-        """获取策略描述"""
-        if market_type == 'RANGING':
-            return {
-                'name': '统计套利网格交易',
-                'description': 'ADX < 20，市场盘整，使用双边网格策略',
-                'icon': '🔄'
-            }
-        else:
-            return {
-                'name': '趋势跟随策略',
-                'description': 'ADX ≥ 20，市场有趋势，使用单边趋势策略',
-                'icon': '📈'
-            }
+        """获取策略描述（非RANGING一律按趋势策略）"""
+        return STRATEGY_DESCRIPTIONS['RANGING' if market_type == 'RANGING' else 'TRENDING']
 
 class TradingBot:
     """交易机器人主类"""
     
+    # 固定属性集合：主循环里频繁访问的属性走slot描述符，不再查实例 __dict__
+    __slots__ = (
+        'mt5', 'risk_manager', 'adaptive_manager', 'is_running', 'trade_count',
+        'indicator_state', 'symbol', 'max_positions', 'trailing_on', '_log_q',
+        '_stop', 'interactive',
+    )
+    
     def __init__(self):
         print("\n" + "="*70)
         print("🤖 高级量化交易机器人 v4.0 - ADX自适应策略版")
@@ -216,6 +392,20 @@ class TradingBot:
         self.adaptive_manager = AdaptiveStrategyManager(initial_capital=100)
         self.is_running = False
         self.trade_count = 0
+        self._stop = threading.Event()  # Ctrl+C 置位，主循环的等待立即返回
+        
+        # 指标递推状态（跨周期保留，只增量计算新K线）
+        self.indicator_state = None
+        
+        # 每周期都要用的配置项绑定成属性，热路径上不再反复查dict
+        self.symbol = TRADING_CONFIG['symbol']
+        self.max_positions = TRADING_CONFIG['max_positions']
+        self.trailing_on = RISK_CONFIG['trailing_stop']
+        # 非终端启动（计划任务/服务）时停止不再等待输入，按 RISK_CONFIG['close_on_stop'] 处理持仓
+        self.interactive = sys.stdin is not None and sys.stdin.isatty()
+        
+        # 实盘时状态面板和周期内的所有输出都在后台线程按入队顺序写出，交易线程只负责入队
+        self._log_q = queue.Queue()
         
     def start(self):
         """启动机器人 - 模式选择"""
@@ -223,7 +413,8 @@ class TradingBot:
         print("   1. 实盘交易模式 (ADX自适应)")
         print("   2. 单月历史回测 (ADX自适应)")
         print("   3. 全年历史回测 (ADX自适应)")
-        mode = input("\n请输入 1、2 或 3（默认1）: ").strip()
+        print("   4. 多年份并行回测 (移动止损 开/关 对比)")
+        mode = input("\n请输入 1、2、3 或 4（默认1）: ").strip()
         
         if mode == "2":
             default_month = (datetime.now().replace(day=1) - timedelta(days=1)).strftime('%Y-%m')
@@ -248,109 +439,184 @@ class TradingBot:
             else:
                 year = int(year_str)
             self.backtest_full_year(year)
+        elif mode == "4":
+            default_year = datetime.now().year - 1
+            years_str = input(f"回测哪些年份？（逗号分隔，默认去年 {default_year}）: ").strip()
+            try:
+                years = [int(y) for y in years_str.split(',')] if years_str else [default_year]
+            except ValueError:
+                print("格式错误，使用默认去年")
+                years = [default_year]
+            self.backtest_matrix([
+                {'start_year': y, 'start_month': 1, 'end_year': y, 'end_month': 12, 'trailing_stop': trailing}
+                for y in years for trailing in (True, False)
+            ])
         else:
             print("\n🔌 正在连接MT5实盘...")
             if not self.mt5.connect(MT5_CONFIG):
                 print("❌ 无法连接MT5,程序退出")
                 return
             
+            self.mt5.start_tick_poller()
+            threading.Thread(target=self._drain_log, args=(sys.stdout,), daemon=True).start()
             self.show_config()
             self.is_running = True
             self.main_loop()
     
     def show_config(self):
-        """显示配置信息"""
-        print("\n" + "="*70)
-        print("⚙️  系统配置")
-        print("="*70)
-        print(f"交易品种: {TRADING_CONFIG['symbol']}")
-        print(f"时间周期: {TRADING_CONFIG['timeframe']}分钟")
-        print(f"每笔风险: {TRADING_CONFIG['risk_per_trade']*100}%")
-        print(f"最大持仓: {TRADING_CONFIG['max_positions']} 单（网格/趋势均适用）")
-        print(f"ADX阈值: {self.adaptive_manager.adx_threshold}")
-        print(f"ADX<{self.adaptive_manager.adx_threshold}: 双边网格策略（允许多层加仓）")
-        print(f"ADX≥{self.adaptive_manager.adx_threshold}: 单边趋势策略（允许重复开单，最多{TRADING_CONFIG['max_positions']}单）")
-        print(f"移动止损: {'启用' if RISK_CONFIG['trailing_stop'] else '禁用'}")
-        if RISK_CONFIG['trailing_stop']:
-            print(f"移动止损触发: {RISK_CONFIG['min_profit_move_sl']}×ATR")
-        print(f"保本逻辑: 启用 (触发: {RISK_CONFIG['break_even_trigger']}×ATR)")
-        if STRATEGY_PARAMS.get('enable_vol_filter'):
-            print("震荡市休眠: 启用（低波动自动0单）")
-        print("\n⚠️  按 Ctrl+C 停止机器人")
-        print("="*70 + "\n")
+        """显示配置信息（摘要在 config.CONFIG_BANNER 中导入时已拼好）"""
+        print(CONFIG_BANNER)
     
     def main_loop(self):
-        """实盘主运行循环"""
+        """
+        实盘主运行循环
+        Ctrl+C 只置位 _stop：当前周期照常跑完（不会打断下单），等待中则立即醒来，随后安全停止
+        """
+        previous_handler = os_signal.signal(os_signal.SIGINT, lambda *_: self._stop.set())
         try:
-            while self.is_running:
-                account = self.mt5.get_account_info()
-                if not account:
-                    print("❌ 获取账户信息失败，60秒后重试...")
-                    time.sleep(60)
-                    continue
-                
-                if self.check_risk_limits(account['balance']):
-                    print("⚠️  达到风险限制，机器人自动停止")
-                    break
-                
-                df = self.mt5.get_historical_data(bars=600)  # 增加数据量，确保ADX稳定
-                if df is None or len(df) < 100:
-                    print(f"❌ 获取K线数据失败或不足（当前{len(df) if df is not None else 0}根），60秒后重试...")
-                    time.sleep(60)
-                    continue
-                
-                # 计算技术指标
-                df = TechnicalIndicators.calculate_all_indicators(df, STRATEGY_PARAMS)
-                
-                # 使用自适应策略生成信号
-                signal_data = self.adaptive_manager.generate_signal(df)
-                signal = signal_data['signal']
-                market_type = signal_data['market_type']
-                details = signal_data['details']
-                market_info = signal_data['market_info']
-                
-                self.display_status(df, signal, market_type, details, market_info, account)
-                
-                self.manage_positions(df)
-                
-                # === 统一开仓逻辑：网格和趋势都允许重复开单（最多max_positions）===
-                positions = mt5.positions_get(symbol=TRADING_CONFIG['symbol'])
-                current_positions_count = len(positions) if positions else 0
+            # 主循环期间的print都经 _log_q 输出，保证和后台格式化的状态面板顺序一致
+            with contextlib.redirect_stdout(_QueueWriter(self._log_q)):
+                self._run_cycles()
+        finally:
+            # 恢复默认处理，stop() 里询问平仓时 Ctrl+C 仍可直接退出
+            os_signal.signal(os_signal.SIGINT, previous_handler)
+            self._log_q.join()  # 队列里剩下的输出写完再继续（风控退出时也不丢）
+        
+        if self._stop.is_set():
+            self.stop()
+    
+    def _run_cycles(self):
+        """实盘交易周期循环（直到 _stop 置位或触发风控）"""
+        while not self._stop.is_set():
+            account = self.mt5.get_account_info()
+            if not account:
+                print("❌ 获取账户信息失败，60秒后重试...")
+                self._stop.wait(60)
+                continue
+            
+            if self.check_risk_limits(account['balance']):
+                print("⚠️  达到风险限制，机器人自动停止")
+                break
+            
+            # 获取K线并计算技术指标（只增量计算新K线）
+            df = self._refresh_market_data()
+            if df is None or len(df) < 100:
+                print(f"❌ 获取K线数据失败或不足（当前{len(df) if df is not None else 0}根），60秒后重试...")
+                self._stop.wait(60)
+                continue
+            
+            # 使用自适应策略生成信号
+            signal_data = self.adaptive_manager.generate_signal(df)
+            signal = signal_data['signal']
+            market_type = signal_data['market_type']
+            details = signal_data['details']
+            market_info = signal_data['market_info']
+            
+            # 最新K线的标量、持仓和报价每周期只取一次，供显示/持仓管理/开仓共用
+            # （持仓管理只改止损，不会改变持仓数；持仓取自连接器缓存，不查询终端）
+            latest = self._latest_values(df)
+            positions = self.mt5.cached_positions()
+            current_positions_count = len(positions) if positions else 0
+            price_info = self.mt5.get_current_price()
+            
+            self.display_status(latest, signal, market_type, details, market_info, account,
+                                current_positions_count)
+            
+            self.manage_positions(latest, positions, price_info)
+            
+            # === 统一开仓逻辑：网格和趋势都允许重复开单（最多max_positions）===
+            if not price_info:
+                print("⚠️ 获取当前价格失败，跳过本次开仓检查")
+            else:
+                price = price_info['ask'] if signal == 1 else price_info['bid']
                 
-                price_info = self.mt5.get_current_price()
-                if not price_info:
-                    print("⚠️ 获取当前价格失败，跳过本次开仓检查")
-                else:
-                    price = price_info['ask'] if signal == 1 else price_info['bid']
-                    
-                    if current_positions_count < TRADING_CONFIG['max_positions'] and signal != 0:
-                        if market_type == 'RANGING':
-                            grid_action = details.get('grid_action', 'HOLD')
-                            grid_lot_size = details.get('grid_lot_size', 0.01)
-                            
-                            if grid_action != 'HOLD':
-                                # 网格使用executor计算的专业手数
-                                lot_size = max(grid_lot_size, 0.01)
-                                stops = self.adaptive_manager.calculate_stops(signal, price, df, market_type, details.get('grid_info'))
-                                sl = stops['stop_loss']
-                                tp = stops['take_profit']
-                                
-                                if self.mt5.open_position(signal, price, lot_size, sl, tp):
-                                    self.trade_count += 1
-                                    self.risk_manager.daily_trades += 1
-                                    print(f"✅ 网格加仓成功! 动作: {grid_action} | 方向: {'多' if signal == 1 else '空'} | "
-                                          f"手数: {lot_size:.3f} | 止损: {sl:.2f} | 止盈: {tp:.2f}")
+                if current_positions_count < self.max_positions and signal != 0:
+                    if market_type == 'RANGING':
+                        grid_action = details.get('grid_action', 'HOLD')
+                        grid_lot_size = details.get('grid_lot_size', 0.01)
                         
-                        else:  # TRENDING
-                            # 趋势模式使用标准手数计算（允许重复开单）
-                            self.execute_adaptive_trade(signal, df, account['balance'], market_type, details)
-                
-                print(f"\n⏳ 等待60秒下一根K线...")
-                print("-"*70)
-                time.sleep(60)
-                
-        except KeyboardInterrupt:
-            self.stop()
+                        if grid_action != 'HOLD':
+                            # 网格使用executor计算的专业手数
+                            lot_size = max(grid_lot_size, 0.01)
+                            stops = self.adaptive_manager.calculate_stops(signal, price, latest, market_type, details.get('grid_info'))
+                            sl = stops['stop_loss']
+                            tp = stops['take_profit']
+                            
+                            if self.mt5.open_position(signal, price, lot_size, sl, tp):
+                                self.trade_count += 1
+                                self.risk_manager.daily_trades += 1
+                                print(f"✅ 网格加仓成功! 动作: {grid_action} | 方向: {'多' if signal == 1 else '空'} | "
+                                      f"手数: {lot_size:.3f} | 止损: {sl:.2f} | 止盈: {tp:.2f}")
+                    
+                    else:  # TRENDING
+                        # 趋势模式使用标准手数计算（允许重复开单）
+                        self.execute_adaptive_trade(signal, latest, account['balance'], market_type, details,
+                                                price_info)
+            
+            sleep_s = self._seconds_to_next_bar()
+            print(f"\n⏳ 等待{sleep_s:.0f}秒到下一根K线收盘...")
+            print("-"*70)
+            self._wait_next_bar(sleep_s, latest)
+    
+    def _wait_next_bar(self, sleep_s, latest):
+        """
+        等待 sleep_s 秒到下一根K线收盘（_stop 置位时立即返回）；信号仍按K线收盘计算，
+        但等待期间每 POSITION_CHECK_INTERVAL 秒用最新报价跑一次持仓管理，快速行情下止损不会晚一整根K线才跟上
+        latest: 本周期最新K线字段（ATR取自已收盘K线，K线内不变）
+        """
+        deadline = time.monotonic() + sleep_s
+        while not self._stop.wait(min(POSITION_CHECK_INTERVAL, max(deadline - time.monotonic(), 0))):
+            if time.monotonic() >= deadline:
+                return
+            self.manage_positions(latest, self.mt5.cached_positions(), self.mt5.get_current_price())
+    
+    @staticmethod
+    def _seconds_to_next_bar():
+        """距离当前K线收盘的秒数（按TRADING_CONFIG的周期对齐）+ 少量延迟"""
+        bar_seconds = TRADING_CONFIG['timeframe'] * 60
+        return bar_seconds - (time.time() % bar_seconds) + BAR_CLOSE_DELAY
+    
+    @staticmethod
+    def _build_trade_table(trade_rows, entry_ns, exit_ns, adjustments):
+        """
+        回测结束后把逐笔平仓的元组一次建成交易记录表（列为 TRADE_FIELDS）
+        时间/平仓时间/持仓时间：整列格式化；调整详情：由各笔的止损调整记录拼接
+        """
+        trades = pd.DataFrame.from_records(trade_rows, columns=TRADE_FIELDS)
+        if not trade_rows:
+            return trades
+        entry_times = pd.to_datetime(np.array(entry_ns, dtype=np.int64), unit='ns')
+        exit_times = pd.to_datetime(np.array(exit_ns, dtype=np.int64), unit='ns')
+        trades['时间'] = entry_times.strftime('%Y-%m-%d %H:%M')
+        trades['平仓时间'] = exit_times.strftime('%Y-%m-%d %H:%M')
+        trades['持仓时间'] = np.char.mod('%.1f小时', (exit_times - entry_times).total_seconds().to_numpy() / 3600)
+        trades['调整详情'] = [
+            "; ".join([f"{adj_type}→{new_sl:.2f}" for adj_type, new_sl in adjs]) if adjs else "无"
+            for adjs in adjustments
+        ]
+        return trades
+    
+    @staticmethod
+    def _latest_values(df):
+        """最新一根K线的 LATEST_COLUMNS 字段（.iat 直接取标量，不构造整行Series）"""
+        return {col: df[col].iat[-1] for col in LATEST_COLUMNS if col in df.columns}
+    
+    def _refresh_market_data(self):
+        """
+        获取最新K线并增量更新技术指标
+        K线窗口由MT5Connector的环形缓冲维护（每周期只拉最近几根），
+        指标只重算上次最后一根已收盘K线之后的部分
+        返回: 带指标的DataFrame；获取失败返回None
+        """
+        df = self.mt5.get_historical_data(bars=HISTORY_BARS)  # 增加数据量，确保ADX稳定
+        if df is None:
+            self.indicator_state = None
+            return None
+        
+        df, self.indicator_state = TechnicalIndicators.update_last(
+            df, STRATEGY_PARAMS, self.indicator_state
+        )
+        return df
     
     def backtest_single_month(self, year, month):
         """单月历史回测（本金100U）- ADX自适应"""
@@ -364,394 +630,340 @@ class TradingBot:
         print(f"📊 ADX自适应策略: ADX<{self.adaptive_manager.adx_threshold}=双边网格, ADX≥{self.adaptive_manager.adx_threshold}=单边趋势")
         return self._backtest_logic(year, 1, year, 12, "全年")
     
-    def _backtest_logic(self, start_year, start_month, end_year, end_month, test_type):
-        """通用的回测逻辑（ADX自适应版） - 完整未删除"""
+    def backtest_matrix(self, configs, max_workers=None):
+        """
+        多组回测并行（多个时间段 / 参数组合，每组互相独立）
+        configs: dict列表，每项含 start_year/start_month/end_year/end_month，
+                 可选 trailing_stop（默认按RISK_CONFIG）和 test_type（默认跨月为"全年"，否则"单月"）
+        K线在主进程里一次连接全部取好再分发，子进程不连MT5；每组在独立进程里从零建策略状态，
+        逐笔输出丢弃，只在最后打印汇总
+        返回: 与 configs 顺序一致的回测结果列表（取数失败的为None）
+        """
+        if not self.mt5.connect(MT5_CONFIG):
+            print("❌ 连接失败！")
+            return []
+        periods = [(c['start_year'], c['start_month'], c['end_year'], c['end_month']) for c in configs]
+        rates_by_period = {period: self._fetch_backtest_rates(*period) for period in dict.fromkeys(periods)}
+        self.mt5.disconnect()
+        
+        results = [None] * len(configs)
+        print(f"\n🚀 并行回测 {len(configs)} 组...")
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = {}
+            for k, (config, period) in enumerate(zip(configs, periods)):
+                rates = rates_by_period[period]
+                if rates is None:
+                    print(f"❌ {period[0]}-{period[1]:02d} 到 {period[2]}-{period[3]:02d} 获取数据失败，跳过")
+                    continue
+                test_type = config.get('test_type', "单月" if period[:2] == period[2:] else "全年")
+                trailing_on = config.get('trailing_stop', RISK_CONFIG['trailing_stop'])
+                futures[pool.submit(_backtest_worker, rates, period, test_type, trailing_on)] = k
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+        
+        print("\n" + "="*80)
+        print(f"{'区间':<20} {'移动止损':<8} {'交易':>6} {'胜率':>8} {'最终余额':>12} {'最大回撤':>10}")
+        print("-"*80)
+        for config, period, result in zip(configs, periods, results):
+            if not result:
+                continue
+            summary = result['summary']
+            trailing = '启用' if config.get('trailing_stop', RISK_CONFIG['trailing_stop']) else '禁用'
+            print(f"{period[0]}-{period[1]:02d}→{period[2]}-{period[3]:02d}      {trailing:<8} "
+                  f"{summary['trade_count']:>6} {summary['win_rate']:>7.1f}% "
+                  f"${summary['final_balance']:>11.2f} {summary['max_drawdown']:>9.2f}%")
+        print("="*80)
+        return results
+    
+    @staticmethod
+    def _backtest_dates(start_year, start_month, end_year, end_month):
+        """回测区间 [起始月1日, 结束月的下个月1日)"""
+        from_date = datetime(start_year, start_month, 1)
+        if end_month == 12:
+            to_date = datetime(end_year + 1, 1, 1)
+        else:
+            to_date = datetime(end_year, end_month + 1, 1)
+        return from_date, to_date
+    
+    def _fetch_backtest_rates(self, start_year, start_month, end_year, end_month):
+        """从已连接的MT5取回测区间的K线（rates结构化数组），失败返回None"""
+        from_date, to_date = self._backtest_dates(start_year, start_month, end_year, end_month)
+        rates = mt5.copy_rates_range(TRADING_CONFIG['symbol'], self.mt5.timeframe, from_date, to_date)
+        if rates is None or len(rates) == 0:
+            return None
+        return rates
+    
+    def _backtest_logic(self, start_year, start_month, end_year, end_month, test_type, verbose=True):
+        """通用的回测逻辑（ADX自适应版） - 完整未删除；verbose=False 时不输出逐笔日志和报告"""
         print(f"📈 移动止损: {'启用' if RISK_CONFIG['trailing_stop'] else '禁用'}")
         print(f"📈 保本逻辑: 启用 (触发: {RISK_CONFIG['break_even_trigger']}×ATR)")
         
         if RISK_CONFIG['trailing_stop']:
             print(f"📈 移动止损触发: {RISK_CONFIG['min_profit_move_sl']}×ATR")
         
-        SPREAD = 0.3  # 黄金典型点差
-        print(f"💸 交易成本: 点差 ${SPREAD:.2f}")
+        print(f"💸 交易成本: 点差 ${BACKTEST_SPREAD:.2f}")
         print(f"💰 手数计算: 每100U开0.01手")
         
         if not self.mt5.connect(MT5_CONFIG):
             print("❌ 连接失败！")
             return
         
-        from_date = datetime(start_year, start_month, 1)
-        if end_month == 12:
-            to_date = datetime(end_year + 1, 1, 1)
-        else:
-            to_date = datetime(end_year, end_month + 1, 1)
-        
-        rates = mt5.copy_rates_range(TRADING_CONFIG['symbol'], self.mt5.timeframe, from_date, to_date)
+        period = (start_year, start_month, end_year, end_month)
+        rates = self._fetch_backtest_rates(*period)
         self.mt5.disconnect()
         
-        if rates is None or len(rates) == 0:
+        if rates is None:
             print("❌ 获取数据失败！请在MT5打开XAUUSD M15图表，下载相应时间段数据")
             return
         
-        df = pd.DataFrame(rates)
-        df['time'] = pd.to_datetime(df['time'], unit='s')
+        # 回测过程中的输出（逐笔平仓、网格/策略模块的提示、报告）先写进内存，
+        # 结束后一次 write 到控制台，不在热循环里逐行print刷新；出异常也照样输出已有内容
+        log_buf = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(log_buf):
+                return self._run_backtest(rates, period, test_type, verbose)
+        finally:
+            sys.stdout.write(log_buf.getvalue())
+            sys.stdout.flush()
+    
+    def _run_backtest(self, rates, period, test_type, verbose=True):
+        """
+        回测主体：只用传入的K线和 adaptive_manager / trailing_on / max_positions，不访问MT5
+        （backtest_matrix 在子进程里直接调用）
+        period: (start_year, start_month, end_year, end_month)
+        verbose: 是否输出逐笔平仓日志和报告（输出被丢弃时传False，连格式化也省掉）
+        """
+        start_year, start_month, end_year, end_month = period
+        from_date, to_date = self._backtest_dates(*period)
+        SPREAD = BACKTEST_SPREAD
+        
+        # 只把指标/信号用到的 high/low/close 字段建成DataFrame（不复制 open/tick_volume/spread 等），
+        # 时间戳单独转成DatetimeIndex；逐K线循环里直接按下标取ndarray，不再构造整行Series
+        df = pd.DataFrame({field: rates[field] for field in ('high', 'low', 'close')})
+        times = pd.to_datetime(rates['time'], unit='s')
+        times_ns = times.to_numpy(dtype='datetime64[ns]').view(np.int64)
         print(f"✅ 加载 {len(df)} 根K线 ({from_date.strftime('%Y-%m')} 到 {to_date.strftime('%Y-%m')})")
         
         # 计算技术指标
         df = TechnicalIndicators.calculate_all_indicators(df, STRATEGY_PARAMS)
+        close = df['close'].to_numpy()
+        atr = df['ATR'].to_numpy()
         
         initial_balance = 100.0
         balance = initial_balance
-        positions = []
         trade_count = 0
         wins = 0
         
-        # 手数计算函数
-        def calculate_position_size(balance, market_type):
-            """计算交易手数"""
-            lot_size = (balance / 100) * 0.01
-            if market_type == 'RANGING':
-                multiplier = 1.0
-            else:
-                multiplier = 1.2
-            lot_size *= multiplier
-            min_lot = 0.01
-            max_lot = 1.0
-            lot_size = max(min_lot, min(lot_size, max_lot))
-            return round(lot_size, 2)
-        
-        # 考虑点差的盈亏计算
-        def calculate_trade_profit(direction, entry_price, exit_price, lot_size):
-            if direction == 1:  # 多单
-                actual_entry = entry_price + (SPREAD / 2)
-                actual_exit = exit_price - (SPREAD / 2)
-                profit = (actual_exit - actual_entry) * lot_size * 100
-            else:  # 空单
-                actual_entry = entry_price - (SPREAD / 2)
-                actual_exit = exit_price + (SPREAD / 2)
-                profit = (actual_entry - actual_exit) * lot_size * 100
-            return profit, actual_entry, actual_exit
-        
-        # 详细交易记录
-        trade_records = []
-        equity_curve = []
-        peak_equity = initial_balance
-        max_drawdown = 0
-        max_drawdown_details = {}
+        # 逐K线循环里用到的配置项先取成局部变量
+        break_even_trigger = RISK_CONFIG['break_even_trigger']
+        trailing_on = self.trailing_on
+        min_profit_move_sl = RISK_CONFIG['min_profit_move_sl']
+        max_positions = self.max_positions
+        
+        # 持仓按结构数组（SoA）存放，逐K线交给 run_bar 内核一次处理；
+        # 只在开仓/平仓时才用到的字段（时间、市场类型、调整记录）放在 positions.meta
+        positions = BacktestPositions(max_positions)
+        adj_flags = np.zeros(max_positions, dtype=np.int8)
+        close_code = np.zeros(max_positions, dtype=np.int8)
+        exit_px = np.zeros(max_positions)
+        
+        # 考虑点差的盈亏由 trade_pnl 一个表达式算出；开/平各付半个点差的实际成交价只用于交易记录
+        half_spread = SPREAD / 2
+        
+        # 详细交易记录：逐笔只存 TRADE_FIELDS 顺序的元组（开/平仓时间只记int64纳秒、调整记录只存原始列表），
+        # 回测结束后由 _build_trade_table 一次建表并格式化
+        trade_rows = []
+        record_entry_ns = []
+        record_exit_ns = []
+        record_adjustments = []
+        recorded_profit = 0.0  # 已记录交易的盈亏合计（报告里的平均每笔盈亏）
+        bar_balance = np.full(len(df), initial_balance)  # 每根K线平仓后的余额，回测结束后一次算回撤
+        bar_positions = np.zeros(len(df), dtype=np.int64)  # 每根K线平仓后、开仓前的持仓数（权益曲线用）
         monthly_performance = []
-        current_month = None
-        month_start_balance = initial_balance
         
-        # 市场类型统计
-        market_type_stats = {
-            'RANGING': {'trades': 0, 'wins': 0, 'profit': 0},
-            'TRENDING': {'trades': 0, 'wins': 0, 'profit': 0}
-        }
+        # 市场类型统计：行按 MARKET_TYPES，列为 [笔数, 盈利笔数, 总盈亏]
+        mt_stats = np.zeros((len(MARKET_TYPES), 3))
         
         print(f"\n开始模拟交易... ({test_type}模式)")
         
+        # 信号所需的ADX/投票/滚动统计量整段预计算一次，逐K线只取第i行，不再切片复制前缀
+        precomputed = self.adaptive_manager.generate_signal_vectorized(df)
+        trend_idle = precomputed['trend_idle']
+        
         for i in range(300, len(df)):
-            current_df = df.iloc[:i+1].copy()
-            latest = current_df.iloc[-1]
-            current_time = latest['time']
-            current_atr = latest['ATR'] if 'ATR' in latest else 10
+            current_atr = atr[i]
             
-            # 月度统计
-            current_month_key = current_time.strftime('%Y-%m')
-            if current_month != current_month_key:
-                if current_month is not None:
-                    monthly_performance.append({
-                        'month': current_month,
-                        'start_balance': month_start_balance,
-                        'end_balance': balance,
-                        'return': ((balance - month_start_balance) / month_start_balance) * 100
-                    })
-                current_month = current_month_key
-                month_start_balance = balance
+            # 使用自适应策略生成信号（空仓且趋势市无信号的K线不会有任何变化，跳过信号组装）
+            if not positions.n and trend_idle[i]:
+                signal = 0
+            else:
+                signal_data = self.adaptive_manager.generate_signal_at(df, i, precomputed)
+                signal = signal_data['signal']
+                market_type = signal_data['market_type']
+                confidence = signal_data['confidence']
+                details = signal_data['details']
             
-            # 使用自适应策略生成信号
-            signal_data = self.adaptive_manager.generate_signal(current_df)
-            signal = signal_data['signal']
-            market_type = signal_data['market_type']
-            confidence = signal_data['confidence']
-            details = signal_data['details']
+            # 持仓管理：保本 / 移动止损 / 止盈止损检查由内核一次处理全部持仓
+            current_price = close[i]
+            n_closed = n_adjusted = 0
+            if positions.n:
+                n_closed, n_adjusted = run_bar(
+                    float(current_price), float(current_atr), positions.n,
+                    positions.direction, positions.entry, positions.sl, positions.tp,
+                    positions.be_triggered, positions.extreme, positions.last_adj,
+                    break_even_trigger, trailing_on, min_profit_move_sl, TRAIL_ATR_MULT,
+                    adj_flags, close_code, exit_px
+                )
             
-            # 持仓管理
-            for pos in positions[:]:
-                close_reason = None
-                profit = 0
-                current_price = latest['close']
-                
-                # BE保本逻辑
-                should_move_to_be = False
-                if pos['direction'] == 1:
-                    profit_distance = current_price - pos['entry']
-                    if profit_distance >= RISK_CONFIG['break_even_trigger'] * current_atr:
-                        should_move_to_be = True
-                else:
-                    profit_distance = pos['entry'] - current_price
-                    if profit_distance >= RISK_CONFIG['break_even_trigger'] * current_atr:
-                        should_move_to_be = True
-                
-                if should_move_to_be and not pos['be_triggered']:
-                    new_sl = pos['entry']
-                    pos['sl'] = new_sl
-                    pos['be_triggered'] = True
-                    pos['adjustments'].append({
-                        'time': current_time,
-                        'type': '保本',
-                        'new_sl': new_sl,
-                        'reason': f"盈利达到{RISK_CONFIG['break_even_trigger']}×ATR"
-                    })
-                
-                # 移动止损逻辑
-                if RISK_CONFIG['trailing_stop']:
-                    min_profit = RISK_CONFIG['min_profit_move_sl'] * current_atr
-                    if pos['direction'] == 1:
-                        current_profit = current_price - pos['entry']
-                        if current_profit > min_profit:
-                            if 'highest_price' not in pos:
-                                pos['highest_price'] = current_price
-                            else:
-                                pos['highest_price'] = max(pos['highest_price'], current_price)
-                            highest_profit = pos['highest_price'] - pos['entry']
-                            if highest_profit > min_profit:
-                                new_sl = pos['highest_price'] - (1.2 * current_atr)
-                                if new_sl > pos['sl']:
-                                    pos['sl'] = new_sl
-                                    pos['adjustments'].append({
-                                        'time': current_time,
-                                        'type': '移动止损',
-                                        'new_sl': new_sl,
-                                        'reason': f"盈利超过{min_profit:.2f}"
-                                    })
-                    else:
-                        current_profit = pos['entry'] - current_price
-                        if current_profit > min_profit:
-                            if 'lowest_price' not in pos:
-                                pos['lowest_price'] = current_price
-                            else:
-                                pos['lowest_price'] = min(pos['lowest_price'], current_price)
-                            highest_profit = pos['entry'] - pos['lowest_price']
-                            if highest_profit > min_profit:
-                                new_sl = pos['lowest_price'] + (1.2 * current_atr)
-                                if new_sl < pos['sl']:
-                                    pos['sl'] = new_sl
-                                    pos['adjustments'].append({
-                                        'time': current_time,
-                                        'type': '移动止损',
-                                        'new_sl': new_sl,
-                                        'reason': f"盈利超过{min_profit:.2f}"
-                                    })
-                
-                # 检查平仓
-                if pos['direction'] == 1:
-                    if current_price >= pos['tp']:
-                        profit, actual_entry, actual_exit = calculate_trade_profit(pos['direction'], pos['entry'], pos['tp'], pos['lot'])
-                        close_reason = "止盈"
-                    elif current_price <= pos['sl']:
-                        profit, actual_entry, actual_exit = calculate_trade_profit(pos['direction'], pos['entry'], pos['sl'], pos['lot'])
-                        close_reason = "止损"
-                        if pos['be_triggered'] and pos['sl'] == pos['entry']:
-                            close_reason = f"保本止损"
-                        elif len(pos['adjustments']) > 0 and pos['adjustments'][-1]['type'] == '移动止损':
-                            close_reason = f"移动止损"
-                else:
-                    if current_price <= pos['tp']:
-                        profit, actual_entry, actual_exit = calculate_trade_profit(pos['direction'], pos['entry'], pos['tp'], pos['lot'])
-                        close_reason = "止盈"
-                    elif current_price >= pos['sl']:
-                        profit, actual_entry, actual_exit = calculate_trade_profit(pos['direction'], pos['entry'], pos['sl'], pos['lot'])
-                        close_reason = "止损"
-                        if pos['be_triggered'] and pos['sl'] == pos['entry']:
-                            close_reason = f"保本止损"
-                        elif len(pos['adjustments']) > 0 and pos['adjustments'][-1]['type'] == '移动止损':
-                            close_reason = f"移动止损"
-                
-                if close_reason:
+            if n_adjusted:
+                # 调整记录只存 (类型, 新止损) 元组，调整详情在回测结束后统一拼接
+                for k in np.flatnonzero(adj_flags[:positions.n]):
+                    adjustments = positions.meta[k]['adjustments']
+                    if adj_flags[k] & ADJ_BE:
+                        adjustments.append(('保本', float(positions.entry[k])))
+                    if adj_flags[k] & ADJ_TRAIL:
+                        adjustments.append(('移动止损', float(positions.sl[k])))
+            
+            if n_closed:
+                closed = positions.closed_slots(close_code)
+                for k in closed:
+                    pos = positions.meta[k]
+                    direction = int(positions.direction[k])
+                    lot = float(positions.lot[k])
+                    profit = trade_pnl(direction, float(positions.entry[k]), float(exit_px[k]), lot, SPREAD)
+                    
                     balance += profit
-                    trade_record = {
-                        '序号': trade_count + 1,
-                        '时间': pos['entry_time'].strftime('%Y-%m-%d %H:%M'),
-                        '方向': '多' if pos['direction'] == 1 else '空',
-                        '开仓价': pos['entry'],
-                        '实际开仓价': actual_entry,
-                        '平仓价': current_price,
-                        '实际平仓价': actual_exit,
-                        '平仓时间': current_time.strftime('%Y-%m-%d %H:%M'),
-                        '手数': pos['lot'],
-                        '初始止损': pos['initial_sl'],
-                        '最终止损': pos['sl'],
-                        '止盈价': pos['tp'],
-                        '盈亏金额': profit,
-                        '盈亏百分比': (profit / initial_balance) * 100,
-                        '平仓原因': close_reason,
-                        '持仓时间': f"{(current_time - pos['entry_time']).total_seconds() / 3600:.1f}小时",
-                        'ATR开仓时': pos['entry_atr'],
-                        'ATR平仓时': current_atr,
-                        '保本触发': '是' if pos['be_triggered'] else '否',
-                        '止损调整次数': len(pos['adjustments']),
-                        '调整详情': "; ".join([f"{adj['type']}→{adj['new_sl']:.2f}" for adj in pos['adjustments']]) if pos['adjustments'] else "无",
-                        '当时余额': balance - profit,
-                        '点差成本': SPREAD,
-                        '市场类型': pos['market_type'],
-                        '信号信心度': pos.get('confidence', 0)
-                    }
-                    trade_records.append(trade_record)
+                    entry_price = positions.entry[k]
+                    tp_price = positions.tp[k]
+                    trade_rows.append((
+                        trade_count + 1, None, '多' if direction == 1 else '空',  # 时间：回测结束后填入
+                        entry_price, entry_price + direction * half_spread,
+                        current_price, exit_px[k] - direction * half_spread, None, lot,
+                        positions.initial_sl[k], positions.sl[k], tp_price,
+                        profit, (profit / initial_balance) * 100, CLOSE_REASONS[close_code[k]], None,
+                        positions.entry_atr[k], current_atr, '是' if positions.be_triggered[k] else '否',
+                        len(pos['adjustments']), None, balance - profit, SPREAD,
+                        pos['market_type'], pos.get('confidence', 0),
+                    ))
+                    recorded_profit += profit
+                    record_entry_ns.append(positions.entry_ns[k])
+                    record_exit_ns.append(times_ns[i])
+                    record_adjustments.append(pos['adjustments'])
                     
-                    market_type_stats[pos['market_type']]['trades'] += 1
-                    market_type_stats[pos['market_type']]['profit'] += profit
-                    if profit > 0:
-                        market_type_stats[pos['market_type']]['wins'] += 1
+                    m = MARKET_INDEX[pos['market_type']]
+                    mt_stats[m, 0] += 1
+                    mt_stats[m, 1] += profit > 0
+                    mt_stats[m, 2] += profit
                     
-                    if test_type == "单月" or (test_type == "全年" and trade_count % 10 == 0):
+                    if verbose and (test_type == "单月" or (test_type == "全年" and trade_count % 10 == 0)):
                         color = "🟢" if profit > 0 else "🔴"
                         market_icon = "🔄" if pos['market_type'] == 'RANGING' else "📈"
-                        print(f"{market_icon}{color} #{trade_record['序号']} | {trade_record['方向']} | "
+                        print(f"{market_icon}{color} #{trade_count + 1} | {'多' if direction == 1 else '空'} | "
                               f"市场:{pos['market_type']} | "
-                              f"开:{trade_record['开仓价']:.2f}→平:{trade_record['平仓价']:.2f} | "
-                              f"止:{pos['sl']:.2f} | 盈:{trade_record['止盈价']:.2f} | "
-                              f"手数:{trade_record['手数']:.2f} | "
-                              f"盈亏:${profit:+.2f} | 原因:{trade_record['平仓原因']}")
+                              f"开:{entry_price:.2f}→平:{current_price:.2f} | "
+                              f"止:{positions.sl[k]:.2f} | 盈:{tp_price:.2f} | "
+                              f"手数:{lot:.2f} | "
+                              f"盈亏:${profit:+.2f} | 原因:{CLOSE_REASONS[close_code[k]]}")
                     
                     trade_count += 1
                     if profit > 0:
                         wins += 1
-                    
-                    positions.remove(pos)
-            
-            # 记录权益曲线
-            if test_type == "单月" or i % 100 == 0:
-                equity_curve.append({
-                    'time': current_time,
-                    'equity': balance,
-                    'positions': len(positions)
-                })
+                
+                positions.remove_slots(closed)
             
-            # 计算最大回撤
-            if balance > peak_equity:
-                peak_equity = balance
-            current_drawdown = (peak_equity - balance) / peak_equity * 100 if peak_equity > 0 else 0
-            if current_drawdown > max_drawdown:
-                max_drawdown = current_drawdown
-                max_drawdown_details = {
-                    'peak_equity': peak_equity,
-                    'trough_equity': balance,
-                    'drawdown_percent': max_drawdown,
-                    'time': current_time
-                }
+            bar_balance[i] = balance
+            bar_positions[i] = positions.n
             
             # 开仓逻辑
-            if signal != 0 and len(positions) < TRADING_CONFIG['max_positions']:
-                lot = calculate_position_size(balance, market_type)
-                price = latest['close']
-                stops = self.adaptive_manager.calculate_stops(signal, price, current_df, market_type, 
+            if signal != 0 and positions.n < max_positions:
+                lot = RiskManager.calculate_position_size(balance, LOT_MULTIPLIER[market_type])
+                price = current_price
+                stops = self.adaptive_manager.calculate_stops(signal, price, {'ATR': current_atr}, market_type, 
                                                             details.get('grid_info') if details else None)
                 
-                positions.append({
-                    'direction': signal,
-                    'entry': price,
-                    'entry_time': current_time,
-                    'entry_atr': current_atr,
-                    'lot': lot,
-                    'sl': stops['stop_loss'],
-                    'initial_sl': stops['stop_loss'],
-                    'tp': stops['take_profit'],
-                    'be_triggered': False,
+                positions.open(signal, price, stops['stop_loss'], stops['take_profit'], lot, current_atr,
+                               times_ns[i], {
                     'adjustments': [],
                     'market_type': market_type,
                     'confidence': confidence,
-                    'highest_price': price if signal == 1 else None,
-                    'lowest_price': price if signal == -1 else None
                 })
         
-        # 最后一个月
-        if current_month is not None:
-            monthly_performance.append({
-                'month': current_month,
-                'start_balance': month_start_balance,
-                'end_balance': balance,
-                'return': ((balance - month_start_balance) / month_start_balance) * 100
-            })
+        # 月度统计：整数月份键的变化点切出每个月，月初/月末余额直接取 bar_balance
+        # （bar_balance[j-1] 即第j根K线开始前的余额，第300根之前为初始资金）
+        if len(df) > 300:
+            month_key = times.year.to_numpy()[300:] * 12 + times.month.to_numpy()[300:]
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(month_key)) + 1)) + 300
+            ends = np.append(starts[1:], len(df))
+            for month, start, end in zip(times[starts].strftime('%Y-%m'), starts, ends):
+                start_balance = float(bar_balance[start - 1])
+                end_balance = float(bar_balance[end - 1])
+                monthly_performance.append({
+                    'month': month,
+                    'start_balance': start_balance,
+                    'end_balance': end_balance,
+                    'return': ((end_balance - start_balance) / start_balance) * 100
+                })
         
         # 平剩余持仓
-        if positions:
+        if positions.n:
             print(f"\n📝 回测结束，平掉剩余持仓...")
-            for pos in positions:
-                profit, actual_entry, actual_exit = calculate_trade_profit(
-                    pos['direction'], pos['entry'], df.iloc[-1]['close'], pos['lot']
-                )
+            # 与 trade_pnl 同一表达式，对剩余持仓整体算一次
+            n = positions.n
+            final_profits = ((close[-1] - positions.entry[:n]) * positions.direction[:n] - SPREAD) * positions.lot[:n] * 100.0
+            for profit in final_profits.tolist():
                 balance += profit
-                trade_count += 1
-                if profit > 0:
-                    wins += 1
+            trade_count += n
+            wins += int((final_profits > 0).sum())
         
-        # 完整报告（你的原代码未删）
-        print("\n" + "="*80)
-        print(f"📊 {test_type}回测详细报告 - ADX自适应策略")
-        print("="*80)
+        # 最大回撤：余额序列的历史高点一次累积，取回撤最大（最早）的那根K线
+        # （第300根之前还没开始交易，只是初始资金，高点/低点都从第300根起找）
+        peak = np.maximum.accumulate(bar_balance)
+        drawdown = (peak - bar_balance) / peak * 100
+        worst = 300 + int(drawdown[300:].argmax()) if len(df) > 300 else 0
+        max_drawdown = float(drawdown[worst]) if len(df) > 300 else 0.0
+        max_drawdown_details = {}
+        if max_drawdown > 0:
+            peak_at = 300 + int(bar_balance[300:worst + 1].argmax())  # 这段回撤开始的高点
+            max_drawdown_details = {
+                'peak_equity': float(peak[worst]),
+                'trough_equity': float(bar_balance[worst]),
+                'drawdown_percent': max_drawdown,
+                'peak_time': times[peak_at],
+                'time': times[worst]
+            }
         
-        print(f"\n📈 基本统计:")
-        print(f"   交易笔数: {trade_count} 笔")
-        if trade_count > 0:
-            print(f"   盈利笔数: {wins} 笔")
-            print(f"   亏损笔数: {trade_count - wins} 笔")
-            print(f"   胜率: {wins/trade_count*100:.1f}%")
-            if trade_records:
-                avg_profit = sum(t['盈亏金额'] for t in trade_records) / len(trade_records)
-                print(f"   平均每笔盈亏: ${avg_profit:+.2f}")
-        
-        print(f"\n🌐 市场类型表现:")
-        for market_type, stats in market_type_stats.items():
-            if stats['trades'] > 0:
-                win_rate = stats['wins'] / stats['trades'] * 100
-                avg_profit = stats['profit'] / stats['trades']
-                market_name = "双边网格" if market_type == 'RANGING' else "单边趋势"
-                print(f"   {market_name}: {stats['trades']}笔 | 胜率: {win_rate:.1f}% | "
-                      f"总盈亏: ${stats['profit']:+.2f} | 平均: ${avg_profit:+.2f}")
-        
-        print(f"\n💰 资金表现:")
-        print(f"   初始本金: ${initial_balance:,.2f}")
-        print(f"   最终本金: ${balance:,.2f}")
-        total_return = ((balance / initial_balance) - 1) * 100
-        print(f"   总收益率: {total_return:+.2f}%")
+        trade_records = self._build_trade_table(trade_rows, record_entry_ns, record_exit_ns, record_adjustments)
         
-        print(f"\n📉 回撤分析:")
-        print(f"   最大回撤: {max_drawdown:.2f}%")
-        if max_drawdown_details:
-            print(f"   回撤高点: ${max_drawdown_details['peak_equity']:.2f}")
-            print(f"   回撤低点: ${max_drawdown_details['trough_equity']:.2f}")
-            print(f"   回撤发生时间: {max_drawdown_details['time'].strftime('%Y-%m-%d %H:%M')}")
+        # 权益曲线（按列存放）：单月取每根K线，其余每100根取一根
+        curve_idx = np.arange(300, len(df))
+        if test_type != "单月":
+            curve_idx = curve_idx[curve_idx % 100 == 0]
+        equity_curve = {
+            'time': times[curve_idx],
+            'equity': bar_balance[curve_idx],
+            'positions': bar_positions[curve_idx],
+        }
         
-        if test_type == "全年" and monthly_performance:
-            print(f"\n📅 月度表现:")
-            print("-"*60)
-            print(f"{'月份':<8} {'开始余额':<12} {'结束余额':<12} {'收益率':<10}")
-            print("-"*60)
-            positive_months = 0
-            total_monthly_return = 0
-            for perf in monthly_performance:
-                color = "🟢" if perf['return'] > 0 else "🔴"
-                print(f"{perf['month']:<8} ${perf['start_balance']:<11.2f} ${perf['end_balance']:<11.2f} {perf['return']:>+8.2f}% {color}")
-                if perf['return'] > 0:
-                    positive_months += 1
-                total_monthly_return += perf['return']
-            print("-"*60)
-            monthly_win_rate = positive_months / len(monthly_performance) * 100
-            avg_monthly_return = total_monthly_return / len(monthly_performance)
-            print(f"   盈利月份: {positive_months}/{len(monthly_performance)} ({monthly_win_rate:.1f}%)")
-            print(f"   平均月收益: {avg_monthly_return:.2f}%")
+        total_return = ((balance / initial_balance) - 1) * 100
+        avg_profit = recorded_profit / len(trade_records) if len(trade_records) else None
+        mt_trades, mt_wins, mt_profit = mt_stats.T
+        
+        # 完整报告（你的原代码未删）：整段拼好后一次输出；交易太少时只给一行简要结果
+        if verbose and trade_count >= REPORT_MIN_TRADES:
+            print(self._format_report(
+                test_type, trade_count, wins, avg_profit, mt_stats, initial_balance, balance,
+                total_return, max_drawdown, max_drawdown_details, monthly_performance
+            ))
+        elif verbose:
+            print(f"\n📊 {test_type}回测: 交易 {trade_count} 笔（不足{REPORT_MIN_TRADES}笔，只显示简要结果） | "
+                  f"总收益率: {total_return:+.2f}% | 最大回撤: {max_drawdown:.2f}%")
         
         # 保存CSV
-        if trade_records:
+        if len(trade_records):
             try:
-                import csv
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f"backtest_adx_report_{test_type}_{start_year}_{start_month}_to_{end_year}_{end_month}_{timestamp}.csv"
-                with open(filename, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.DictWriter(f, fieldnames=trade_records[0].keys())
-                    writer.writeheader()
-                    writer.writerows(trade_records)
+                stem = f"backtest_adx_report_{test_type}_{start_year}_{start_month}_to_{end_year}_{end_month}_{timestamp}"
+                filename = self._save_trade_csv(trade_records, stem)
                 print(f"\n💾 详细交易记录已保存到: {filename}")
             except Exception as e:
                 print(f"\n⚠️  保存文件失败: {e}")
@@ -760,7 +972,10 @@ class TradingBot:
             'trade_records': trade_records,
             'equity_curve': equity_curve,
             'monthly_performance': monthly_performance,
-            'market_type_stats': market_type_stats,
+            'market_type_stats': {
+                market_type: {'trades': int(mt_trades[j]), 'wins': int(mt_wins[j]), 'profit': float(mt_profit[j])}
+                for j, market_type in enumerate(MARKET_TYPES)
+            },
             'summary': {
                 'initial_balance': initial_balance,
                 'final_balance': balance,
@@ -772,70 +987,155 @@ class TradingBot:
             }
         }
     
+    @staticmethod
+    def _save_trade_csv(trades, stem):
+        """
+        交易记录写入 stem.csv；同一秒内多次回测（如并行回测的多个子进程）文件名相同时，
+        以独占方式创建文件、已存在就加序号 _1、_2…，不会互相覆盖。返回实际文件名
+        """
+        for n in itertools.count():
+            filename = f"{stem}.csv" if n == 0 else f"{stem}_{n}.csv"
+            try:
+                # 整表一次写出；带BOM的utf-8让Excel正确识别中文表头
+                trades.to_csv(filename, index=False, encoding='utf-8-sig', mode='x')
+                return filename
+            except FileExistsError:
+                continue
+    
+    @staticmethod
+    def _format_report(test_type, trade_count, wins, avg_profit, mt_stats, initial_balance, balance,
+                       total_return, max_drawdown, max_drawdown_details, monthly_performance):
+        """
+        回测详细报告的文本（每行一个元素拼成一段，调用方一次输出）
+        avg_profit: 已记录交易的平均每笔盈亏（无记录为None）；mt_stats: 按 MARKET_TYPES 的 [笔数, 盈利笔数, 总盈亏]
+        """
+        buf = [
+            "\n" + "="*80,
+            f"📊 {test_type}回测详细报告 - ADX自适应策略",
+            "="*80,
+            f"\n📈 基本统计:",
+            f"   交易笔数: {trade_count} 笔",
+        ]
+        if trade_count > 0:
+            buf.append(f"   盈利笔数: {wins} 笔")
+            buf.append(f"   亏损笔数: {trade_count - wins} 笔")
+            buf.append(f"   胜率: {wins/trade_count*100:.1f}%")
+            if avg_profit is not None:
+                buf.append(f"   平均每笔盈亏: ${avg_profit:+.2f}")
+        
+        buf.append(f"\n🌐 市场类型表现:")
+        mt_trades, mt_wins, mt_profit = mt_stats.T
+        mt_win_rate = mt_wins / np.maximum(mt_trades, 1) * 100
+        mt_avg_profit = mt_profit / np.maximum(mt_trades, 1)
+        for j in np.flatnonzero(mt_trades):
+            buf.append(f"   {MARKET_NAMES[MARKET_TYPES[j]]}: {int(mt_trades[j])}笔 | 胜率: {mt_win_rate[j]:.1f}% | "
+                       f"总盈亏: ${mt_profit[j]:+.2f} | 平均: ${mt_avg_profit[j]:+.2f}")
+        
+        buf.append(f"\n💰 资金表现:")
+        buf.append(f"   初始本金: ${initial_balance:,.2f}")
+        buf.append(f"   最终本金: ${balance:,.2f}")
+        buf.append(f"   总收益率: {total_return:+.2f}%")
+        
+        buf.append(f"\n📉 回撤分析:")
+        buf.append(f"   最大回撤: {max_drawdown:.2f}%")
+        if max_drawdown_details:
+            buf.append(f"   回撤高点: ${max_drawdown_details['peak_equity']:.2f} "
+                       f"({max_drawdown_details['peak_time'].strftime('%Y-%m-%d %H:%M')})")
+            buf.append(f"   回撤低点: ${max_drawdown_details['trough_equity']:.2f}")
+            buf.append(f"   回撤发生时间: {max_drawdown_details['time'].strftime('%Y-%m-%d %H:%M')}")
+        
+        if test_type == "全年" and monthly_performance:
+            buf.append(f"\n📅 月度表现:")
+            buf.append("-"*60)
+            buf.append(f"{'月份':<8} {'开始余额':<12} {'结束余额':<12} {'收益率':<10}")
+            buf.append("-"*60)
+            for perf in monthly_performance:
+                color = "🟢" if perf['return'] > 0 else "🔴"
+                buf.append(f"{perf['month']:<8} ${perf['start_balance']:<11.2f} ${perf['end_balance']:<11.2f} {perf['return']:>+8.2f}% {color}")
+            buf.append("-"*60)
+            # 汇总统计用月收益率数组一次算出，循环里只做输出
+            monthly_returns = np.fromiter((perf['return'] for perf in monthly_performance),
+                                          dtype=np.float64, count=len(monthly_performance))
+            positive_months = int((monthly_returns > 0).sum())
+            monthly_win_rate = positive_months / len(monthly_returns) * 100
+            avg_monthly_return = monthly_returns.mean()
+            best, worst = int(monthly_returns.argmax()), int(monthly_returns.argmin())
+            buf.append(f"   盈利月份: {positive_months}/{len(monthly_returns)} ({monthly_win_rate:.1f}%)")
+            buf.append(f"   平均月收益: {avg_monthly_return:.2f}% | 月收益标准差: {monthly_returns.std():.2f}%")
+            buf.append(f"   最好月份: {monthly_performance[best]['month']} ({monthly_returns[best]:+.2f}%) | "
+                       f"最差月份: {monthly_performance[worst]['month']} ({monthly_returns[worst]:+.2f}%)")
+        
+        return "\n".join(buf)
+    
     def check_risk_limits(self, balance):
         return self.risk_manager.check_daily_loss_limit(balance) or \
                self.risk_manager.check_max_drawdown(balance)
     
-    def display_status(self, df, signal, market_type, details, market_info, account):
-        """显示状态 - 显示ATR和ADX"""
-        latest = df.iloc[-1]
-        current_atr = latest['ATR'] if 'ATR' in latest and pd.notna(latest['ATR']) else 0.0
+    def display_status(self, latest, signal, market_type, details, market_info, account, positions_count):
+        """
+        显示状态 - 显示ATR和ADX（latest: _latest_values 返回的最新K线字段）
+        这里只把数据入队，格式化和输出由后台线程 _drain_log 完成
+        """
+        self._log_q.put((datetime.now(), latest, signal, market_type, details,
+                         market_info, account, positions_count))
+    
+    def _format_status(self, now, latest, signal, market_type, details, market_info, account, positions_count):
+        """把一个周期的状态数据格式化成一整段文本"""
+        current_atr = _latest_atr(latest, 0.0)
         
-        print(f"\n[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}]")
-        print("="*70)
-        print(f"💰 账户: 余额 ${account['balance']:.2f} | 净值 ${account['equity']:.2f} | 浮盈 ${account['profit']:.2f}")
+        buf = [
+            f"\n[{now.strftime('%Y-%m-%d %H:%M:%S')}]",
+            "="*70,
+            f"💰 账户: 余额 ${account['balance']:.2f} | 净值 ${account['equity']:.2f} | 浮盈 ${account['profit']:.2f}",
+        ]
         
         adx_display = f"{market_info['adx']:.1f}" if market_info['adx'] > 0 else "计算中..."
         atr_display = f"{current_atr:.2f}" if current_atr > 0 else "计算中..."
-        print(f"📊 价格: {latest['close']:.2f} | ATR: {atr_display} | ADX: {adx_display} | 市场: {market_info['market_desc']} | 方向: {market_info['direction']}")
+        buf.append(f"📊 价格: {latest['close']:.2f} | ATR: {atr_display} | ADX: {adx_display} | 市场: {market_info['market_desc']} | 方向: {market_info['direction']}")
         
-        strategy_desc = self.adaptive_manager.get_strategy_description(market_type)
-        print(f"🤖 策略: {strategy_desc['icon']} {strategy_desc['name']}")
+        strategy_desc = STRATEGY_DESCRIPTIONS[market_type]
+        buf.append(f"🤖 策略: {strategy_desc['icon']} {strategy_desc['name']}")
         
         if market_type == 'RANGING':
             if 'grid_info' in details and details['grid_info']:
                 grid = details['grid_info']
-                print(f"🔄 网格: {len(grid.get('buy_levels', []))}买层/{len(grid.get('sell_levels', []))}卖层 | 宽度: {grid.get('grid_width', 0):.2f}")
+                buf.append(f"🔄 网格: {len(grid.get('buy_levels', []))}买层/{len(grid.get('sell_levels', []))}卖层 | 宽度: {grid.get('grid_width', 0):.2f}")
             grid_action = details.get('grid_action', 'HOLD')
             if grid_action != 'HOLD':
-                print(f"📋 网格动作: {grid_action} | 建议手数: {details.get('grid_lot_size', 0):.3f}")
+                buf.append(f"📋 网格动作: {grid_action} | 建议手数: {details.get('grid_lot_size', 0):.3f}")
         else:
             if 'strategy_votes' in details:
-                print(f"\n🗳️ 策略投票:")
+                buf.append(f"\n🗳️ 策略投票:")
                 for name, vote in details['strategy_votes'].items():
-                    emoji = "📈" if "买入" in vote else "📉" if "卖出" in vote else "➖"
-                    print(f"   {emoji} {name}: {vote}")
+                    buf.append(f"   {VOTE_EMOJIS[vote]} {name}: {VOTE_LABELS[vote]}")
         
-        signal_text = "🟢 买入" if signal == 1 else "🔴 卖出" if signal == -1 else "⚪ 无信号"
-        print(f"\n{signal_text}")
-        positions = mt5.positions_get(symbol=TRADING_CONFIG['symbol'])
-        positions_count = len(positions) if positions else 0
-        print(f"📌 持仓: {positions_count} 张 (最大{TRADING_CONFIG['max_positions']}张)" if positions_count > 0 else "📌 当前无持仓")
+        buf.append(f"\n{SIGNAL_TEXTS.get(signal, SIGNAL_TEXTS[0])}")
+        buf.append(f"📌 持仓: {positions_count} 张 (最大{self.max_positions}张)" if positions_count > 0 else "📌 当前无持仓")
+        return "\n".join(buf)
     
-    def execute_adaptive_trade(self, signal, df, balance, market_type, details):
-        """执行自适应交易（趋势模式使用）"""
-        latest = df.iloc[-1]
-        price_info = self.mt5.get_current_price()
-        if not price_info: return
-        
+    def _drain_log(self, out):
+        """
+        后台线程：取出状态数据格式化成一整段，或主循环期间 print 的原文，按入队顺序写入 out
+        out: 启动线程时的真实stdout（主循环期间 sys.stdout 被替换为 _QueueWriter）
+        """
+        while True:
+            item = self._log_q.get()
+            try:
+                out.write(item if isinstance(item, str) else self._format_status(*item) + "\n")
+                out.flush()
+            except Exception as e:
+                out.write(f"⚠️ 状态显示失败: {e}\n")
+            finally:
+                self._log_q.task_done()
+    
+    def execute_adaptive_trade(self, signal, latest, balance, market_type, details, price_info):
+        """执行自适应交易（趋势模式使用，latest: 最新K线字段，price_info: 本周期的报价）"""
         price = price_info['ask'] if signal == 1 else price_info['bid']
         
-        def calculate_position_size(balance, market_type):
-            lot_size = (balance / 100) * 0.01
-            if market_type == 'RANGING':
-                multiplier = 1.0
-            else:
-                multiplier = 1.2
-            lot_size *= multiplier
-            min_lot = 0.01
-            max_lot = 1.0
-            lot_size = max(min_lot, min(lot_size, max_lot))
-            return round(lot_size, 2)
-        
-        lot_size = calculate_position_size(balance, market_type)
+        lot_size = self.risk_manager.calculate_position_size(balance, LOT_MULTIPLIER[market_type])
         
         grid_info = details.get('grid_info') if details else None
-        stops = self.adaptive_manager.calculate_stops(signal, price, df, market_type, grid_info)
+        stops = self.adaptive_manager.calculate_stops(signal, price, latest, market_type, grid_info)
         
         sl = stops['stop_loss']
         tp = stops['take_profit']
@@ -846,51 +1146,71 @@ class TradingBot:
             print(f"✅ 开仓成功! 方向: {'多' if signal == 1 else '空'} | 手数: {lot_size:.3f} | "
                   f"止损: {sl:.2f} | 止盈: {tp:.2f}")
     
-    def manage_positions(self, df):
-        """持仓管理（BE + 移动止损） - ATR NaN保护"""
-        positions = mt5.positions_get(symbol=TRADING_CONFIG['symbol'])
-        if positions is None or len(positions) == 0:
+    def manage_positions(self, latest, positions, price_info):
+        """
+        持仓管理（BE + 移动止损） - ATR NaN保护
+        latest: 最新K线字段；positions / price_info: 主循环本周期取到的持仓和报价
+        """
+        if positions is None or len(positions) == 0 or not price_info:
             return
         
-        latest = df.iloc[-1]
-        price_info = self.mt5.get_current_price()
-        if not price_info:
-            return
+        atr = _latest_atr(latest, 10)
         
-        atr = latest['ATR'] if 'ATR' in latest and pd.notna(latest['ATR']) else 10
+        # 所有持仓的新止损一次性向量化计算，只对止损真正变化的持仓发MT5请求
+        n = len(positions)
+        is_long = np.fromiter((p.type == 0 for p in positions), dtype=bool, count=n)
+        entry = np.fromiter((p.price_open for p in positions), dtype=np.float64, count=n)
+        old_sl = np.fromiter((p.sl for p in positions), dtype=np.float64, count=n)
+        current = np.where(is_long, price_info['bid'], price_info['ask'])
         
-        for position in positions:
-            pos_type = 'LONG' if position.type == 0 else 'SHORT'
-            current_price = price_info['bid'] if pos_type == 'LONG' else price_info['ask']
-            
-            if self.risk_manager.should_move_to_breakeven(pos_type, position.price_open, current_price, atr):
-                new_sl = position.price_open
-                self.mt5.modify_position(position, new_sl, position.tp)
-                print(f"✅ [{position.ticket}] 移至盈亏平衡: {new_sl:.2f}")
-            
-            if RISK_CONFIG['trailing_stop']:
-                new_sl = self.risk_manager.calculate_trailing_stop(
-                    pos_type, position.price_open, current_price, position.sl, atr
-                )
-                if new_sl:
-                    if (pos_type == 'LONG' and new_sl > position.sl) or (pos_type == 'SHORT' and new_sl < position.sl):
-                        self.mt5.modify_position(position, new_sl, position.tp)
-                        print(f"✅ [{position.ticket}] 移动止损更新: {new_sl:.2f}")
+        new_sl, reason = self.risk_manager.update_stops(
+            is_long, entry, current, old_sl, atr, trailing=self.trailing_on
+        )
+        
+        changed = np.flatnonzero(reason != STOP_UNCHANGED)
+        if len(changed) == 0:
+            return
+        
+        # 需要改单的持仓一次性提交，请求并发发出
+        changes = [(positions[i], float(new_sl[i]), positions[i].tp) for i in changed]
+        self.mt5.modify_positions(changes)
+        for i, (position, sl, _) in zip(changed, changes):
+            if reason[i] == STOP_BREAKEVEN:
+                print(f"✅ [{position.ticket}] 移至盈亏平衡: {sl:.2f}")
+            else:
+                print(f"✅ [{position.ticket}] 移动止损更新: {sl:.2f}")
     
     def stop(self):
         """停止机器人"""
         print("\n\n⚠️  收到停止信号...")
         self.is_running = False
+        self._log_q.join()  # 等待状态面板输出完毕
         print(f"\n📊 今日交易统计: {self.trade_count} 笔")
-        positions = mt5.positions_get(symbol=TRADING_CONFIG['symbol'])
+        # 退出前的平仓确认要以终端为准：强制全量核对一次，再从缓存取
+        self.mt5.sync_positions()
+        positions = self.mt5.cached_positions()
         if positions:
-            response = input(f"\n当前有 {len(positions)} 张持仓，是否全部平仓？(y/n): ")
-            if response.lower() == 'y':
+            if self.interactive:
+                response = input(f"\n当前有 {len(positions)} 张持仓，是否全部平仓？(y/n): ")
+                close_all = response.lower() == 'y'
+            else:
+                close_all = RISK_CONFIG.get('close_on_stop', False)
+                print(f"\n当前有 {len(positions)} 张持仓，非交互运行，按配置{'全部平仓' if close_all else '保留持仓'}")
+            if close_all:
                 self.mt5.close_all_positions()
                 print("✅ 所有持仓已平")
         self.mt5.disconnect()
         print("\n✅ 机器人已安全停止")
 
+def _backtest_worker(rates, period, test_type, trailing_on):
+    """backtest_matrix 的子进程入口：新建一套策略状态跑一组回测（不连MT5，逐笔输出丢弃）"""
+    bot = TradingBot.__new__(TradingBot)  # 不走 __init__：不需要MT5连接器和状态面板线程
+    bot.adaptive_manager = AdaptiveStrategyManager(initial_capital=100)
+    bot.trailing_on = trailing_on
+    bot.max_positions = TRADING_CONFIG['max_positions']
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        return bot._run_backtest(rates, period, test_type, verbose=False)
+
 # ==================== 主程序入口 ====================
 if __name__ == "__main__":
     print("""
@@ -904,5 +1224,9 @@ if __name__ == "__main__":
 🚀 正在启动...
 """)
     
+    # 预热JIT内核（读取磁盘编译缓存），避免第一个交易周期卡顿
+    prewarm_adx()
+    prewarm_indicators()
+    
     bot = TradingBot()
     bot.start()
\ No newline at end of file
@@ -3,19 +3,53 @@ MT5连接和交易执行模块
 处理所有与MT5的交互
 """
 
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import MetaTrader5 as mt5
+import numpy as np
 import pandas as pd
 from datetime import datetime
 
+RING_UPDATE_BARS = 3  # K线环形缓冲每次增量拉取的根数（含未收盘的最新一根）
+RING_PRICE_FIELDS = ('open', 'high', 'low', 'close')  # 环形缓冲里按float32存放的价格字段
+TICK_POLL_INTERVAL = 0.2  # 后台报价轮询间隔（秒）
+TICK_MAX_AGE = 2.0        # 缓存报价超过这么久没更新就退回直接查询（秒）
+POSITION_RESYNC_INTERVAL = 300  # 持仓缓存定时与终端全量核对的间隔（秒）
+MODIFY_MAX_WORKERS = 8  # 批量改单时同时在途的请求数上限
+
 class MT5Connector:
     """MT5连接器"""
     
+    # 实盘每周期都会多次访问这些属性，用 __slots__ 省掉实例 __dict__
+    __slots__ = (
+        'config', 'symbol', 'timeframe', 'magic_number', 'connected', 'digits',
+        '_rates', '_head', '_last_tick', '_tick_thread', '_tick_stop',
+        '_positions', '_positions_synced',
+    )
+    
     def __init__(self, config):
         self.config = config
         self.symbol = config['symbol']
         self.timeframe = self._get_timeframe(config['timeframe'])
         self.magic_number = config['magic_number']
         self.connected = False
+        self.digits = 2  # 品种报价小数位，连接后按 symbol_info 更新
+        
+        # K线环形缓冲：MT5 rates结构化数组（价格字段为float32），_head 为最旧一根所在槽位
+        self._rates = None
+        self._head = 0
+        
+        # 后台报价缓存：(bid, ask, 报价时间戳, 写入时的monotonic时间)
+        # 只有轮询线程写、整体替换元组，读方无需加锁
+        self._last_tick = None
+        self._tick_thread = None
+        self._tick_stop = threading.Event()
+        
+        # 本品种持仓缓存 {ticket: 持仓}：开/改/平仓成功时就地维护，
+        # 只在每 POSITION_RESYNC_INTERVAL 秒或下单失败后才用 positions_get 全量核对
+        self._positions = None
+        self._positions_synced = 0.0
     
     def _get_timeframe(self, minutes):
         """将分钟数转换为MT5时间周期"""
@@ -68,7 +102,11 @@ class MT5Connector:
             print(f"   服务器: {account_info.server}")
             print(f"   余额: ${account_info.balance:.2f}")
             print(f"   净值: ${account_info.equity:.2f}\n")
+            symbol_info = mt5.symbol_info(self.symbol)
+            if symbol_info is not None:
+                self.digits = symbol_info.digits
             self.connected = True
+            self.sync_positions()
             return True
         else:
             print(f"❌ 登录失败: {mt5.last_error()}")
@@ -91,14 +129,86 @@ class MT5Connector:
         参数:
         - bars: 获取多少根K线
         
+        同样根数的窗口重复获取时（实盘每周期），只拉最近RING_UPDATE_BARS根
+        写入预分配的环形缓冲，不再整窗口重新拉取
+        
         返回: DataFrame
         """
+        if self._rates is not None and len(self._rates) == bars and self._update_ring():
+            return self._ring_frame()
+        
         rates = mt5.copy_rates_from_pos(self.symbol, self.timeframe, 0, bars)
         
         if rates is None:
             print(f"❌ 获取数据失败: {mt5.last_error()}")
+            self._rates = None
             return None
         
+        rates = self._to_float32(rates)
+        
+        # 拉满bars根时保留为环形缓冲，供下次增量更新
+        if len(rates) == bars:
+            self._rates = rates
+            self._head = 0
+        else:
+            self._rates = None
+        
+        return self._rates_to_frame(rates)
+    
+    def _update_ring(self):
+        """
+        增量拉取最新几根K线写入环形缓冲：同一时间的K线（未收盘）原地覆盖，新K线覆盖最旧一根
+        返回: True/False（False表示拉取失败或与缓冲断档，需要整窗口重新拉取）
+        """
+        new = mt5.copy_rates_from_pos(self.symbol, self.timeframe, 0, RING_UPDATE_BARS)
+        if new is None or len(new) == 0:
+            return False
+        new = self._to_float32(new)
+        
+        cap = len(self._rates)
+        last = (self._head - 1) % cap
+        last_time = self._rates['time'][last]
+        if new['time'][0] > last_time:
+            return False  # 中间缺了K线
+        
+        for rate in new:
+            if rate['time'] < last_time:
+                continue
+            if rate['time'] == last_time:
+                self._rates[last] = rate
+            else:
+                self._rates[self._head] = rate
+                last = self._head
+                last_time = rate['time']
+                self._head = (self._head + 1) % cap
+        return True
+    
+    def _ring_frame(self):
+        """按时间顺序把环形缓冲转成DataFrame（未绕回时无需重排）"""
+        if self._head == 0:
+            return self._rates_to_frame(self._rates)
+        return self._rates_to_frame(np.concatenate((self._rates[self._head:], self._rates[:self._head])))
+    
+    @staticmethod
+    def _to_float32(rates):
+        """
+        MT5 rates -> 价格字段为float32的结构化数组副本
+        黄金报价只有2位小数，float32足够，环形缓冲和下游指标计算的内存带宽减半；
+        发给MT5的价格由 _price 转回float64
+        """
+        dtype = np.dtype([
+            (name, np.float32 if name in RING_PRICE_FIELDS else rates.dtype[name])
+            for name in rates.dtype.names
+        ])
+        return rates.astype(dtype)
+    
+    def _price(self, value):
+        """送往MT5的价格：转回Python float（float64）并按品种小数位取整"""
+        return round(float(value), self.digits)
+    
+    @staticmethod
+    def _rates_to_frame(rates):
+        """MT5 rates结构化数组 -> 以time为索引的DataFrame"""
         df = pd.DataFrame(rates)
         df['time'] = pd.to_datetime(df['time'], unit='s')
         df.set_index('time', inplace=True)
@@ -122,18 +232,59 @@ class MT5Connector:
             'profit': account.profit
         }
     
+    def start_tick_poller(self):
+        """启动后台报价轮询线程，之后 get_current_price 直接读缓存，不再每次查询终端"""
+        if self._tick_thread is not None and self._tick_thread.is_alive():
+            return
+        self._tick_stop.clear()
+        self._tick_thread = threading.Thread(target=self._poll_ticks, daemon=True)
+        self._tick_thread.start()
+    
+    def _poll_ticks(self):
+        """轮询线程：每 TICK_POLL_INTERVAL 秒取一次报价写入 _last_tick"""
+        while True:
+            tick = mt5.symbol_info_tick(self.symbol)
+            if tick is not None:
+                self._last_tick = (tick.bid, tick.ask, tick.time, time.monotonic())
+            if self._tick_stop.wait(TICK_POLL_INTERVAL):
+                break
+    
     def get_current_price(self):
-        """获取当前价格"""
-        tick = mt5.symbol_info_tick(self.symbol)
-        if tick is None:
-            return None
+        """获取当前价格（轮询线程在跑且缓存够新时直接用缓存）"""
+        cached = self._last_tick
+        if cached is not None and time.monotonic() - cached[3] <= TICK_MAX_AGE:
+            bid, ask, tick_time, _ = cached
+        else:
+            tick = mt5.symbol_info_tick(self.symbol)
+            if tick is None:
+                return None
+            bid, ask, tick_time = tick.bid, tick.ask, tick.time
         
         return {
-            'bid': tick.bid,
-            'ask': tick.ask,
-            'time': datetime.fromtimestamp(tick.time)
+            'bid': bid,
+            'ask': ask,
+            'time': datetime.fromtimestamp(tick_time)
         }
     
+    def sync_positions(self):
+        """用 positions_get 全量刷新持仓缓存（查询失败则保持失效，下次再试）"""
+        positions = mt5.positions_get(symbol=self.symbol)
+        if positions is None:
+            self._positions = None
+            return
+        self._positions = {p.ticket: p for p in positions}
+        self._positions_synced = time.monotonic()
+    
+    def cached_positions(self):
+        """
+        本品种当前持仓（同 positions_get(symbol=...)，但走缓存，主循环每周期不再查询终端）
+        服务器端止盈/止损平掉的持仓最多 POSITION_RESYNC_INTERVAL 秒后才从缓存消失，
+        期间对它的改单会失败并触发提前核对
+        """
+        if self._positions is None or time.monotonic() - self._positions_synced > POSITION_RESYNC_INTERVAL:
+            self.sync_positions()
+        return tuple(self._positions.values()) if self._positions is not None else ()
+    
     def get_positions(self):
         """获取当前持仓"""
         positions = mt5.positions_get(symbol=self.symbol)
@@ -157,7 +308,7 @@ class MT5Connector:
         
         返回: True/False
         """
-
+        price, sl, tp = self._price(price), self._price(sl), self._price(tp)
         
         # 确定订单类型
         if signal == 1:
@@ -188,8 +339,16 @@ class MT5Connector:
         
         if result.retcode != mt5.TRADE_RETCODE_DONE:
             print(f"❌ 开仓失败: {result.comment}")
+            self._positions = None
             return False
         
+        # 市价单成交后持仓号即订单号，只查这一张加入缓存；查不到就下周期全量核对
+        opened = mt5.positions_get(ticket=result.order)
+        if opened and self._positions is not None:
+            self._positions[opened[0].ticket] = opened[0]
+        else:
+            self._positions = None
+        
         print(f"\n{'📈' if signal == 1 else '📉'} {action_str}成功!")
         print(f"   价格: {price:.2f}")
         print(f"   手数: {lot_size}")
@@ -210,6 +369,7 @@ class MT5Connector:
         
         返回: True/False
         """
+        new_sl, new_tp = self._price(new_sl), self._price(new_tp)
         request = {
             "action": mt5.TRADE_ACTION_SLTP,
             "symbol": self.symbol,
@@ -222,11 +382,27 @@ class MT5Connector:
         
         if result.retcode == mt5.TRADE_RETCODE_DONE:
             print(f"✅ 修改止损成功: {new_sl:.2f}")
+            # 先取到局部变量：批量改单时别的线程可能同时把缓存置为失效
+            positions = self._positions
+            if positions is not None and position.ticket in positions:
+                positions[position.ticket] = position._replace(sl=new_sl, tp=new_tp)
             return True
         else:
             print(f"❌ 修改止损失败: {result.comment}")
+            self._positions = None  # 持仓可能已在服务器端平掉，下周期全量核对
             return False
     
+    def modify_positions(self, changes):
+        """
+        批量修改止损止盈，changes: [(持仓, 新止损, 新止盈), ...]
+        多笔时用线程池同时发出，等待时间约为一次往返而不是逐笔相加
+        返回: 与 changes 对应的 True/False 列表
+        """
+        if len(changes) <= 1:
+            return [self.modify_position(*change) for change in changes]
+        with ThreadPoolExecutor(max_workers=min(MODIFY_MAX_WORKERS, len(changes))) as pool:
+            return list(pool.map(lambda change: self.modify_position(*change), changes))
+    
     def close_position(self, position):
         """
         平仓
@@ -264,9 +440,12 @@ class MT5Connector:
         if result.retcode == mt5.TRADE_RETCODE_DONE:
             pnl = position.profit
             print(f"{'✅' if pnl > 0 else '❌'} 平仓成功 | 盈亏: ${pnl:.2f}")
+            if self._positions is not None:
+                self._positions.pop(position.ticket, None)
             return True
         else:
             print(f"❌ 平仓失败: {result.comment}")
+            self._positions = None
             return False
     
     def close_all_positions(self):
@@ -277,6 +456,12 @@ class MT5Connector:
     
     def disconnect(self):
         """断开MT5连接"""
+        self._tick_stop.set()
+        if self._tick_thread is not None:
+            self._tick_thread.join()
+            self._tick_thread = None
+        self._last_tick = None
+        self._positions = None
         mt5.shutdown()
         self.connected = False
         print("✅ 已断开MT5连接")
\ No newline at end of file
@@ -48,6 +48,10 @@ class ProfessionalRangingStrategy:
         std = close.std()
         current_price = close.iloc[-1]
         zscore = (current_price - sma) / std
+        return self._mean_reversion_from_zscore(zscore)
+    
+    def _mean_reversion_from_zscore(self, zscore):
+        """Z分数 -> (信号, 强度, Z分数)"""
         signal = 0
         strength = 0
         if zscore < -2.0:
@@ -90,17 +94,21 @@ class ProfessionalRangingStrategy:
         recent_high = data['high'].tail(40).max()
         recent_low = data['low'].tail(40).min()
         current_price = data['close'].iloc[-1]
+        atr = data['ATR'].iloc[-1] if 'ATR' in data else 10
+        volatility = self.detect_volatility_regime(data)
+        return self._build_grid(current_price, recent_high, recent_low, atr, volatility, center_price)
+    
+    def _build_grid(self, current_price, recent_high, recent_low, atr, volatility, center_price=None):
+        """按最近40根高低点、ATR和波动率状态布置网格（build_dynamic_grid 的标量部分）"""
         near_key_level, key_level = self.is_near_key_level(current_price)
         if near_key_level:
             print(f"ℹ️  价格在关键位 {key_level} 附近，调整网格布局")
         if center_price is None:
             center_price = current_price
         price_range = recent_high - recent_low
-        atr = data['ATR'].iloc[-1] if 'ATR' in data else 10
         total_range = max(price_range * 0.8, atr * 6)
         min_range = atr * 4
         total_range = max(total_range, min_range)
-        volatility = self.detect_volatility_regime(data)
         if volatility == 'HIGH':
             grid_count = int(self.grid_levels * 0.9)
         elif volatility == 'LOW':
@@ -149,11 +157,14 @@ class ProfessionalRangingStrategy:
         }
     
     def calculate_grid_trading_signal(self, data):
-        self.dynamic_grid = self.build_dynamic_grid(data)
+        return self._grid_signal(self.build_dynamic_grid(data), data['close'].iloc[-1])
+    
+    def _grid_signal(self, grid, current_price):
+        """当前价格落在网格哪一层、信心是否足够（calculate_grid_trading_signal 的标量部分）"""
+        self.dynamic_grid = grid
         if self.dynamic_grid is None:
             self.consecutive_skip += 1
             return 0, 0, None
-        current_price = data['close'].iloc[-1]
         buy_levels = self.dynamic_grid['buy_levels']
         sell_levels = self.dynamic_grid['sell_levels']
         signal = 0
@@ -245,8 +256,84 @@ class ProfessionalRangingStrategy:
         mr_signal, mr_strength, zscore = self.calculate_mean_reversion_signal(df)
         reversal_score, is_reverting = self.calculate_statistical_reversal(df)
         grid_signal, grid_confidence, grid_info = self.calculate_grid_trading_signal(df)
+        return self._combine_signals(mr_signal, mr_strength, zscore, reversal_score, is_reverting,
+                                     grid_signal, grid_confidence, grid_info)
+    
+    def precompute_features(self, df):
+        """
+        回测用：整段K线一次性算出 generate_professional_signal 用到的滚动统计量
+        返回dict，每个数组第i个元素等于对 df.iloc[:i+1] 调用对应方法的结果，
+        逐K线调用 generate_signal_at 时只需O(1)取值，不再每根K线切片重算
+        """
+        n = len(df)
+        close = df['close'].to_numpy(dtype=np.float64)
+        atr = df['ATR'].to_numpy()
+        bars = np.arange(1, n + 1)  # 前缀长度
+        
+        # 波动率状态：最近20根 / 最近lookback根 ATR均值（与 tail().mean() 一样跳过NaN、保持ATR精度）
+        atr_s = pd.Series(atr, dtype=np.float64)
+        recent_atr = atr_s.rolling(20, min_periods=1).mean().to_numpy().astype(atr.dtype)
+        historical_atr = atr_s.rolling(self.lookback, min_periods=1).mean().to_numpy().astype(atr.dtype)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            atr_ratio = recent_atr / historical_atr
+        regime = np.where(atr_ratio > 1.3, 'HIGH', np.where(atr_ratio < 0.7, 'LOW', 'NORMAL'))
+        regime[bars < 60] = 'NORMAL'
+        
+        # 均值回归：最近80根收盘价的Z分数
+        close_s = pd.Series(close)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            zscore = ((close - close_s.rolling(80).mean().to_numpy())
+                      / close_s.rolling(80).std().to_numpy())
+        
+        # 统计反转：最近40根收盘价收益率的1阶自相关（38对样本，同 Series.autocorr）
+        autocorr = np.full(n, np.nan)
+        if n >= 40:
+            returns = close_s.pct_change().to_numpy()
+            x = np.lib.stride_tricks.sliding_window_view(returns[2:], 38)
+            y = np.lib.stride_tricks.sliding_window_view(returns[1:-1], 38)
+            x = x - x.mean(axis=1, keepdims=True)
+            y = y - y.mean(axis=1, keepdims=True)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                autocorr[39:] = (x * y).sum(axis=1) / np.sqrt((x * x).sum(axis=1) * (y * y).sum(axis=1))
+        
+        return {
+            'regime': regime.tolist(),
+            'zscore': zscore,
+            'autocorr': autocorr,
+            'recent_high': df['high'].rolling(40, min_periods=1).max().to_numpy(),
+            'recent_low': df['low'].rolling(40, min_periods=1).min().to_numpy(),
+            'close': close,
+            'atr': atr,
+        }
+    
+    def generate_signal_at(self, i, features):
+        """
+        第 i 根K线的网格信号：与对 df.iloc[:i+1] 调用 generate_professional_signal 结果一致，
+        滚动统计量取自 precompute_features，冷却/连续跳过计数等状态照常逐K线推进
+        """
+        if i + 1 < 80:
+            return 0, 0, {'status': '数据不足'}
+        if not self.check_trade_cooldown():
+            return 0, 0, {'status': '冷却时间中'}
+        self.volatility_regime = features['regime'][i]
+        mr_signal, mr_strength, zscore = self._mean_reversion_from_zscore(features['zscore'][i])
+        autocorr = features['autocorr'][i]
+        if autocorr < -0.12:
+            reversal_score, is_reverting = abs(autocorr), True
+        else:
+            reversal_score, is_reverting = 0, False
+        current_price = features['close'][i]
+        grid = self._build_grid(current_price, features['recent_high'][i], features['recent_low'][i],
+                                features['atr'][i], self.volatility_regime)
+        grid_signal, grid_confidence, grid_info = self._grid_signal(grid, current_price)
+        return self._combine_signals(mr_signal, mr_strength, zscore, reversal_score, is_reverting,
+                                     grid_signal, grid_confidence, grid_info)
+    
+    def _combine_signals(self, mr_signal, mr_strength, zscore, reversal_score, is_reverting,
+                         grid_signal, grid_confidence, grid_info):
+        """综合网格/均值回归/反转等条件，给出最终信号和详情"""
         if grid_signal != 0:
-            win_prob, edge_strength = self.calculate_edge_probability(df, grid_signal, zscore, reversal_score)
+            win_prob, edge_strength = self.calculate_edge_probability(None, grid_signal, zscore, reversal_score)
         else:
             win_prob = 0
             edge_strength = 0
@@ -4,9 +4,41 @@
 已加入动态止损止盈倍数（根据波动率自适应）
 """
 
+import numpy as np
+from _njit import njit
+
+# update_stops 返回的止损调整原因
+STOP_UNCHANGED = 0
+STOP_BREAKEVEN = 1
+STOP_TRAILING = 2
+
+MIN_LOT = 0.01
+MAX_LOT = 1.0
+TRAIL_ATR_MULT = 1.2  # 移动止损与当前价/极值的距离（ATR倍数）
+
+
+@njit('float64(float64, float64)', cache=True)
+def _calc_size(balance, multiplier):
+    """每100U开0.01手，乘以倍数后限制在 [MIN_LOT, MAX_LOT]（未取整）"""
+    lot_size = (balance / 100.0) * 0.01 * multiplier
+    return max(MIN_LOT, min(lot_size, MAX_LOT))
+
+
+@njit('UniTuple(float64, 2)(int64, float64, float64, float64, float64)', cache=True)
+def _calc_sltp(signal, price, atr, sl_mult, tp_mult):
+    """按ATR倍数计算 (止损, 止盈)；signal=1 为买入，其余按卖出处理"""
+    atr_sl = sl_mult * atr
+    atr_tp = tp_mult * atr
+    if signal == 1:
+        return price - atr_sl, price + atr_tp
+    return price + atr_sl, price - atr_tp
+
+
 class RiskManager:
     """风险管理器"""
     
+    __slots__ = ('config', 'daily_pnl', 'start_balance', 'peak_balance', 'daily_trades')
+    
     def __init__(self, risk_config):
         self.config = risk_config
         self.daily_pnl = 0
@@ -14,41 +46,23 @@ class RiskManager:
         self.peak_balance = 0
         self.daily_trades = 0
     
-    def calculate_position_size(self, balance):
+    @staticmethod
+    def calculate_position_size(balance, multiplier=1.0):
         """
-        计算交易手数（根据余额每100U开0.01手）
+        计算交易手数（根据余额每100U开0.01手，multiplier 为市场状态倍数）
         100U → 0.01手
         200U → 0.02手
         1000U → 0.10手
         """
-        # 每100U开0.01手
-        lot_size = (balance / 100) * 0.01
-        
-        # 限制手数范围
-        min_lot = 0.01
-        max_lot = 1.0
-        lot_size = max(min_lot, min(lot_size, max_lot))
-        
-        # 保留2位小数
-        lot_size = round(lot_size, 2)
-        
-        return lot_size
+        # 取整留在Python里做：内置round按十进制精确舍入，numba的round在 .xx5 边界上结果不同
+        return round(_calc_size(float(balance), float(multiplier)), 2)
 
     def calculate_stop_loss_take_profit(self, signal, price, atr, config):
         """
         计算止损和止盈价格（兼容旧调用）
         """
-        atr_sl = config['atr_multiplier_sl'] * atr
-        atr_tp = config['atr_multiplier_tp'] * atr
-        
-        if signal == 1:  # 买入
-            sl = price - atr_sl
-            tp = price + atr_tp
-        else:  # 卖出
-            sl = price + atr_sl
-            tp = price - atr_tp
-        
-        return sl, tp
+        return _calc_sltp(int(signal), float(price), float(atr),
+                          float(config['atr_multiplier_sl']), float(config['atr_multiplier_tp']))
 
   
     
@@ -102,19 +116,48 @@ class RiskManager:
         if position_type == 'LONG':
             profit = current_price - entry_price
             if profit > min_profit:
-                new_sl = current_price - (1.2 * atr)
+                new_sl = current_price - (TRAIL_ATR_MULT * atr)
                 if new_sl > current_sl:
                     return new_sl
         
         else:  # SHORT
             profit = entry_price - current_price
             if profit > min_profit:
-                new_sl = current_price + (1.2 * atr)
+                new_sl = current_price + (TRAIL_ATR_MULT * atr)
                 if new_sl < current_sl:
                     return new_sl
         
         return None
     
+    def update_stops(self, is_long, entry_price, current_price, current_sl, atr, trailing=True):
+        """
+        批量计算所有持仓的新止损（保本 + 移动止损，numpy一次算完）
+        is_long/entry_price/current_price/current_sl: 每个持仓一个元素的数组，current_sl为0表示未设止损
+        规则同 should_move_to_breakeven / calculate_trailing_stop，且止损只会朝有利方向移动
+        返回: (new_sl, reason) —— reason 为 STOP_UNCHANGED / STOP_BREAKEVEN / STOP_TRAILING
+        """
+        direction = np.where(is_long, 1.0, -1.0)
+        profit = (current_price - entry_price) * direction
+        # 未设止损按最远处理（多单 -inf，空单 +inf），任何有效止损都算改善
+        sl = np.where(current_sl != 0, current_sl, -np.inf * direction)
+        
+        new_sl = sl.copy()
+        reason = np.full(len(sl), STOP_UNCHANGED, dtype=np.int8)
+        
+        # 1. 保本：盈利达到 break_even_trigger×ATR 时止损移到开仓价
+        be = (profit >= self.config['break_even_trigger'] * atr) & ((entry_price - new_sl) * direction > 0)
+        new_sl[be] = entry_price[be]
+        reason[be] = STOP_BREAKEVEN
+        
+        # 2. 移动止损：盈利超过 min_profit_move_sl×ATR 时跟随到 当前价∓TRAIL_ATR_MULT×ATR
+        if trailing:
+            trail_sl = current_price - direction * (TRAIL_ATR_MULT * atr)
+            trail = (profit > self.config['min_profit_move_sl'] * atr) & ((trail_sl - new_sl) * direction > 0)
+            new_sl[trail] = trail_sl[trail]
+            reason[trail] = STOP_TRAILING
+        
+        return new_sl, reason
+    
     def get_risk_summary(self, balance):
         """获取风险摘要"""
         if self.start_balance == 0:
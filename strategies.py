@@ -3,6 +3,24 @@
 开单更快 + 吃肉更多 + 假期保护本金
 """
 
+import numpy as np
+import pandas as pd
+
+STRATEGY_NAMES = ['趋势跟踪', '均值回归', '突破', '动量']
+
+# 策略投票编码（内部一律用整数，只在打印处映射成文字/图标）
+VOTE_HOLD = 0
+VOTE_BUY = 1
+VOTE_DORMANT = 2   # 震荡市休眠（低波动）
+VOTE_SELL = -1
+# 按编码直接下标取：[0]中性 [1]买入 [2]休眠 [-1]卖出
+VOTE_LABELS = ('中性', '买入', '休眠(低波动)', '卖出')
+VOTE_EMOJIS = ('➖', '📈', '💤', '📉')
+
+# generate_latest_signal 需要读取的最新K线字段
+_LATEST_COLUMNS = ('close', 'EMA_8', 'EMA_21', 'EMA_100', 'RSI', 'MACD_hist',
+                   'BB_upper', 'BB_lower', 'ATR', 'MOM', 'STOCH_K', 'STOCH_D')
+
 class TradingStrategies:
     """交易策略集合"""
     
@@ -67,6 +85,95 @@ class TradingStrategies:
             return -1
         return 0
     
+    @staticmethod
+    def generate_latest_signal(df, params):
+        """
+        只针对最新一根K线的综合信号（实盘每周期调用）
+        与 generate_combined_signal 结果完全一致，但只用 .iat 取最后两根K线的标量，
+        不构造整行Series，也不对整列做rolling
+        返回: (signal, signal_details)，signal_details 为 {策略名: VOTE_* 整数编码}
+        """
+        row = {c: df[c].iat[-1] for c in _LATEST_COLUMNS}
+        prev_close = df['close'].iat[-2]
+        prev_bb_upper = df['BB_upper'].iat[-2]
+        prev_bb_lower = df['BB_lower'].iat[-2]
+        
+        close = row['close']
+        rsi = row['RSI']
+        atr = row['ATR']
+        atr_col = df['ATR'].to_numpy()
+        
+        # ==================== 震荡市自动休眠神器 ====================
+        if params.get('enable_vol_filter', False):
+            vol_period = params.get('vol_period', 20)
+            vol_threshold = params.get('vol_threshold', 0.6)
+            
+            # 等价于 ATR.rolling(vol_period).mean().iloc[-2]（窗口不满或含NaN时为NaN）
+            if len(atr_col) > 1:
+                window = atr_col[-vol_period - 1:-1]
+                atr_avg = window.mean() if len(window) == vol_period else np.nan
+            else:
+                atr_avg = atr
+            
+            if atr < atr_avg * vol_threshold:
+                signal_details = dict.fromkeys(STRATEGY_NAMES, VOTE_DORMANT)
+                return 0, signal_details
+        # ==========================================================
+        
+        # 策略1: 趋势跟踪
+        if (row['EMA_8'] > row['EMA_21'] > row['EMA_100'] and
+                rsi < params['rsi_overbought'] and row['MACD_hist'] > 0):
+            trend = 1
+        elif (row['EMA_8'] < row['EMA_21'] < row['EMA_100'] and
+              rsi > params['rsi_oversold'] and row['MACD_hist'] < 0):
+            trend = -1
+        else:
+            trend = 0
+        
+        # 策略2: 均值回归
+        bb_position = (close - row['BB_lower']) / (row['BB_upper'] - row['BB_lower'])
+        if rsi < params['rsi_oversold'] and bb_position < 0.3:
+            reversion = 1
+        elif rsi > params['rsi_overbought'] and bb_position > 0.7:
+            reversion = -1
+        else:
+            reversion = 0
+        
+        # 策略3: 突破（ATR均值同 df['ATR'].iloc[-20:].mean()，跳过NaN）
+        atr_tail = atr_col[-20:]
+        atr_tail = atr_tail[~np.isnan(atr_tail)]
+        atr_mean = atr_tail.mean() if len(atr_tail) else np.nan
+        if (close > row['BB_upper'] and prev_close <= prev_bb_upper and
+                atr > atr_mean * 0.8):
+            breakout = 1
+        elif (close < row['BB_lower'] and prev_close >= prev_bb_lower and
+              atr > atr_mean * 0.8):
+            breakout = -1
+        else:
+            breakout = 0
+        
+        # 策略4: 动量
+        if (row['MOM'] > 0 and row['STOCH_K'] > row['STOCH_D'] and
+                row['STOCH_K'] < 80 and rsi > 50):
+            momentum = 1
+        elif (row['MOM'] < 0 and row['STOCH_K'] < row['STOCH_D'] and
+              row['STOCH_K'] > 20 and rsi < 50):
+            momentum = -1
+        else:
+            momentum = 0
+        
+        signals = (trend, reversion, breakout, momentum)
+        total_signal = sum(signals)
+        
+        signal_details = dict(zip(STRATEGY_NAMES, signals))
+        
+        if total_signal >= params['signal_threshold_buy']:
+            return 1, signal_details
+        elif total_signal <= params['signal_threshold_sell']:
+            return -1, signal_details
+        else:
+            return 0, signal_details
+    
     @staticmethod
     def generate_combined_signal(df, params):
         """
@@ -83,8 +190,7 @@ class TradingStrategies:
             atr_avg = atr_history.iloc[-2] if len(atr_history) > 1 else latest['ATR']
             
             if latest['ATR'] < atr_avg * vol_threshold:
-                strategy_names = ['趋势跟踪', '均值回归', '突破', '动量']
-                signal_details = {name: '休眠(低波动)' for name in strategy_names}
+                signal_details = dict.fromkeys(STRATEGY_NAMES, VOTE_DORMANT)
                 return 0, signal_details
         # ==========================================================
 
@@ -98,15 +204,86 @@ class TradingStrategies:
         
         total_signal = sum(signals)
         
-        strategy_names = ['趋势跟踪', '均值回归', '突破', '动量']
-        signal_details = {
-            name: '买入' if sig == 1 else '卖出' if sig == -1 else '中性'
-            for name, sig in zip(strategy_names, signals)
-        }
+        signal_details = dict(zip(STRATEGY_NAMES, signals))
         
         if total_signal >= params['signal_threshold_buy']:
             return 1, signal_details
         elif total_signal <= params['signal_threshold_sell']:
             return -1, signal_details
         else:
-            return 0, signal_details
\ No newline at end of file
+            return 0, signal_details
+    
+    @staticmethod
+    def generate_signals_vectorized(df, params):
+        """
+        整段K线一次性算出每根K线的综合信号（回测用）
+        第i个元素与对 df.iloc[:i+1] 调用 generate_latest_signal 的结果一致，
+        四个策略的条件都写成整列布尔运算，不再逐K线切片
+        返回: (signals, votes) —— signals 为int8数组；votes 为 (K线数, 4) 的int8数组，
+              列顺序同 STRATEGY_NAMES，编码同 VOTE_*
+        """
+        col = {c: df[c].to_numpy() for c in _LATEST_COLUMNS}
+        close = col['close']
+        rsi = col['RSI']
+        atr = col['ATR']
+        n = len(close)
+        
+        prev_close = np.empty(n)
+        prev_bb_upper = np.empty(n)
+        prev_bb_lower = np.empty(n)
+        prev_close[:1] = prev_bb_upper[:1] = prev_bb_lower[:1] = np.nan
+        prev_close[1:] = close[:-1]
+        prev_bb_upper[1:] = col['BB_upper'][:-1]
+        prev_bb_lower[1:] = col['BB_lower'][:-1]
+        
+        def vote(buy, sell):
+            return np.where(buy, 1, np.where(sell, -1, 0)).astype(np.int8)
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # 策略1: 趋势跟踪
+            trend = vote(
+                (col['EMA_8'] > col['EMA_21']) & (col['EMA_21'] > col['EMA_100']) &
+                (rsi < params['rsi_overbought']) & (col['MACD_hist'] > 0),
+                (col['EMA_8'] < col['EMA_21']) & (col['EMA_21'] < col['EMA_100']) &
+                (rsi > params['rsi_oversold']) & (col['MACD_hist'] < 0),
+            )
+            
+            # 策略2: 均值回归
+            bb_position = (close - col['BB_lower']) / (col['BB_upper'] - col['BB_lower'])
+            reversion = vote(
+                (rsi < params['rsi_oversold']) & (bb_position < 0.3),
+                (rsi > params['rsi_overbought']) & (bb_position > 0.7),
+            )
+            
+            # 策略3: 突破（最近20根ATR均值，跳过NaN）
+            atr_mean = pd.Series(atr, dtype=np.float64).rolling(20, min_periods=1).mean().to_numpy()
+            atr_ok = atr > atr_mean * 0.8
+            breakout = vote(
+                (close > col['BB_upper']) & (prev_close <= prev_bb_upper) & atr_ok,
+                (close < col['BB_lower']) & (prev_close >= prev_bb_lower) & atr_ok,
+            )
+            
+            # 策略4: 动量
+            momentum = vote(
+                (col['MOM'] > 0) & (col['STOCH_K'] > col['STOCH_D']) &
+                (col['STOCH_K'] < 80) & (rsi > 50),
+                (col['MOM'] < 0) & (col['STOCH_K'] < col['STOCH_D']) &
+                (col['STOCH_K'] > 20) & (rsi < 50),
+            )
+        
+        votes = np.column_stack((trend, reversion, breakout, momentum))
+        total = votes.sum(axis=1)
+        signals = vote(total >= params['signal_threshold_buy'], total <= params['signal_threshold_sell'])
+        
+        # 震荡市自动休眠：ATR低于前 vol_period 根均值的 vol_threshold 倍
+        if params.get('enable_vol_filter', False):
+            vol_period = params.get('vol_period', 20)
+            vol_threshold = params.get('vol_threshold', 0.6)
+            atr_avg = np.empty(n)
+            atr_avg[:1] = atr[:1]
+            atr_avg[1:] = pd.Series(atr, dtype=np.float64).rolling(vol_period).mean().to_numpy()[:-1]
+            dormant = atr < atr_avg * vol_threshold
+            signals[dormant] = 0
+            votes[dormant] = VOTE_DORMANT
+        
+        return signals, votes